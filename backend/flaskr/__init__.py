@@ -1,18 +1,108 @@
 import os
-from flask import Flask, request, abort, jsonify
+from flask import (Flask, Response, request, abort, jsonify,
+                   stream_with_context)
 from flask_sqlalchemy import SQLAlchemy
 from flask_cors import CORS
-import random
-
-from models import setup_db, Question, Category
-
-QUESTIONS_PER_PAGE = 10
+from werkzeug.exceptions import HTTPException
+import secrets
+
+import migrations
+from models import (db, setup_db, database_path, pool_stats, Question,
+                    DatabaseConfig)
+from .pagination import paginate_questions, paginate_keyset
+from .counts import question_counts, QuestionCounts
+from .search import (search_questions, question_index, InvertedIndex,
+                     SEARCH_MAX_AGE, SEARCH_INDEX_TTL, SUGGESTIONS_LIMIT,
+                     MAX_SUGGESTIONS_LIMIT)
+from .quiz import (random_question, random_questions, shuffled_deck,
+                   deal_question, deal_questions, QuestionPools,
+                   MAX_QUIZ_BATCH)
+from .sessions import QuizSession, MemorySessionStore, BackendSessionStore
+from .categories import category_cache, CategoryCache, CATEGORIES_MAX_AGE
+from .conditional import conditional, TableVersions
+from .cache import cached, response_cache, ResponseCache
+from .backends import backend_from_url, MemoryBackend
+from .commands import db_cli
+from .replicas import (read_replica, mark_read_only, remember_write,
+                       READ_YOUR_WRITES_WINDOW)
+from .bulk import (iter_rows, import_questions, export_questions,
+                   EXPORT_FORMATS, delete_questions as delete_selection,
+                   update_questions as update_selection)
+
+
+"""
+minimal_return()
+    whether a write asked for a minimal response, with ?return=minimal or
+    a `Prefer: return=minimal` header
+"""
+
+
+def minimal_return():
+    return request.args.get('return') == 'minimal' or \
+        'return=minimal' in request.headers.get('Prefer', '')
 
 
 def create_app(test_config=None):
     # create and configure the app
     app = Flask(__name__)
-    setup_db(app)
+    app.config.from_mapping(
+        SEARCH_BACKEND=os.environ.get('SEARCH_BACKEND', 'auto'),
+        SEARCH_INDEX_TTL=int(
+            os.environ.get('SEARCH_INDEX_TTL', SEARCH_INDEX_TTL)),
+        CACHE_URL=os.environ.get('CACHE_URL', 'memory://'),
+        RESPONSE_CACHE_STALE_TTL=int(
+            os.environ.get('RESPONSE_CACHE_STALE_TTL', 0)),
+        SCHEMA_CHECK=os.environ.get('SCHEMA_CHECK', '1') != '0',
+        DATABASE_URL=os.environ.get('DATABASE_URL', database_path),
+        DATABASE=DatabaseConfig.from_env(),
+        DATABASE_REPLICA_URLS=[url for url in os.environ.get(
+            'DATABASE_REPLICA_URLS', '').split(',') if url],
+        REPLICA_STRATEGY=os.environ.get('REPLICA_STRATEGY', 'round_robin'),
+        READ_YOUR_WRITES_WINDOW=READ_YOUR_WRITES_WINDOW)
+    if test_config is not None:
+        app.config.from_mapping(test_config)
+
+    # caches and quiz sessions are shared between workers unless the
+    # cache backend is in-process
+    cache_backend = backend_from_url(app.config['CACHE_URL'])
+    shared = not isinstance(cache_backend, MemoryBackend)
+    app.extensions['response_cache'] = ResponseCache(
+        cache_backend, stale_ttl=app.config['RESPONSE_CACHE_STALE_TTL'])
+    app.extensions['table_versions'] = TableVersions(cache_backend, shared)
+    # snapshots of the database, kept per app in this process
+    app.extensions['question_counts'] = QuestionCounts()
+    app.extensions['question_pools'] = QuestionPools()
+    app.extensions['category_cache'] = CategoryCache()
+    app.extensions['question_index'] = InvertedIndex(
+        app.config['SEARCH_INDEX_TTL'])
+    if not shared:
+        app.config.setdefault('QUIZ_SESSION_STORE', MemorySessionStore())
+    else:
+        app.config.setdefault(
+            'QUIZ_SESSION_STORE', BackendSessionStore(cache_backend))
+    setup_db(app, app.config['DATABASE_URL'], app.config['DATABASE'],
+             app.config['DATABASE_REPLICA_URLS'],
+             app.config['REPLICA_STRATEGY'])
+    app.cli.add_command(db_cli)
+
+    # starting a worker only reads the schema version row, on the first
+    # request so that `flask db upgrade` can load the app before migrating
+    if app.config['SCHEMA_CHECK']:
+        @app.before_first_request
+        def check_schema():
+            with db.engine.connect() as connection:
+                missing = migrations.pending(connection)
+            if missing:
+                raise migrations.MigrationError(
+                    'database schema is missing migrations {}, '
+                    'run `flask db upgrade`'.format(', '.join(missing)))
+
+    # suggestions (and search with SEARCH_BACKEND=memory) use the
+    # in-process index; build it in the background once the app serves,
+    # rather than in the first request that needs it
+    @app.before_first_request
+    def warm_search_index():
+        question_index.refresh(app)
 
     """
     @DONE: Set up CORS. Allow '*' for origins. Delete the sample route after completing the TODOs
@@ -28,31 +118,29 @@ def create_app(test_config=None):
             "Access-Control-Allow-Headers", "Content-Type,Authorization,true"
         )
         response.headers.add(
-            "Access-Control-Allow-Methods", "GET,PUT,POST,DELETE,OPTIONS"
+            "Access-Control-Allow-Methods", "GET,PUT,POST,PATCH,DELETE,OPTIONS"
         )
-        return response
+        return remember_write(response)
     """
     @DONE:
     Create an endpoint to handle GET requests
     for all available categories.
     """
     @app.route('/categories')
+    @read_replica
     def available_categories():
 
-        categories = Category.query.all()
-        current_category = paginate_questions(request, categories)
-        categories_dict = {}
-        for category in categories:
-            categories_dict[category.id] = category.type
+        categories = category_cache.get()
 
-        if len(current_category) == 0:
+        if len(categories.mapping) == 0:
             abort(404)
 
-        # return successful response
-        return jsonify({
-            'success': True,
-            'categories': categories_dict
-        })
+        # return the pre-serialized response, or 304 if the client has it
+        response = Response(categories.body, mimetype='application/json')
+        response.set_etag(categories.etag)
+        response.cache_control.public = True
+        response.cache_control.max_age = CATEGORIES_MAX_AGE
+        return response.make_conditional(request)
     """
     @DONE:
     Create an endpoint to handle GET requests for questions,
@@ -66,28 +154,16 @@ def create_app(test_config=None):
     Clicking on the page numbers should update the questions.
     """
 
-   # set pagination
-    def paginate_questions(request, selection):
-        page = request.args.get('page', 1, type=int)
-        start = (page - 1) * QUESTIONS_PER_PAGE
-        end = start + QUESTIONS_PER_PAGE
-
-    # Get paginated questions
-        questions = [question.format() for question in selection]
-        current_questions = questions[start:end]
-
-        return current_questions
-
     @app.route('/questions')
+    @read_replica
+    @conditional('questions', 'categories')
+    @cached('questions')
     def all_questions():
 
-        selection = Question.query.order_by(Question.id).all()
-        current_questions = paginate_questions(request, selection)
+        selection = Question.query.order_by(Question.id)
+        current_questions, next_cursor = paginate_keyset(request, selection)
 
-        categories = Category.query.order_by(Category.id).all()
-        categories_dict = {}
-        for category in categories:
-            categories_dict[category.id] = category.type
+        categories_dict = dict(category_cache.mapping())
     # return error if there are no questions
         if len(current_questions) == 0:
             abort(404)
@@ -96,9 +172,11 @@ def create_app(test_config=None):
         return jsonify({
             'success': True,
             'questions': current_questions,
-            'total_questions': len(selection),
+            'total_questions': question_counts.total(
+                exact=request.args.get('exact', 'false') == 'true'),
             'current_categories': None,
-            'categories': categories_dict
+            'categories': categories_dict,
+            'next_cursor': next_cursor
         })
 
     """
@@ -117,8 +195,18 @@ def create_app(test_config=None):
             if question is None:
                 abort(404)
             question.delete()
-            selection = Question.query.order_by(
-                Question.id).all()
+
+            # skip re-listing questions if the client doesn't need them
+            if minimal_return():
+                return jsonify({
+                    'success': True,
+                    'deleted': question_id,
+                    'current_total_questions': question_counts.total(),
+                    'category_total_questions': question_counts.for_category(
+                        question.category)
+                }), 200
+
+            selection = Question.query.order_by(Question.id)
             current_questions = paginate_questions(
                 request, selection)
 
@@ -126,7 +214,7 @@ def create_app(test_config=None):
                 'success': True,
                 'deleted': question_id,
                 'questions': current_questions,
-                'current_total_questions': len(selection)
+                'current_total_questions': question_counts.total()
             }), 200
         except Exception:
             abort(422)
@@ -152,37 +240,130 @@ def create_app(test_config=None):
         try:
 
             if search:
-                questions = Question.query.filter(
-                    Question.question.ilike(f'%{search}%')).all()
-
-                current_questions = [question.format()
-                                     for question in questions]
+                mark_read_only()
+                current_questions, total_questions = search_questions(
+                    request, search)
                 if len(current_questions) == 0:
                     abort(404)
 
                 return jsonify({
                     'success': True,
                     'questions': current_questions,
-                    'total_questions': len(current_questions)
+                    'total_questions': total_questions
                 })
             else:
 
                 question = Question(
                     question=question, answer=answer, difficulty=difficulty,  category=category)
                 question.insert()
-                selection = Question.query.order_by(Question.id).all()
+
+                # skip re-listing questions if the client doesn't need them
+                if minimal_return():
+                    return jsonify({
+                        'success': True,
+                        'created': question.id,
+                        'totalQuestions': question_counts.total(),
+                        'category_total_questions':
+                            question_counts.for_category(category)
+                    }), 200
+
+                selection = Question.query.order_by(Question.id)
                 current_questions = paginate_questions(request, selection)
 
                 return jsonify({
                     'success': True,
                     'created': question.id,
                     'questions': current_questions,
-                    'totalQuestions': len(Question.query.all()),
+                    'totalQuestions': question_counts.total(),
                 }), 200
 
         except:
             abort(422)
 
+    """
+    Import many questions at once from a JSON array or an NDJSON stream.
+    """
+    @app.route('/questions/bulk', methods=['POST'])
+    def bulk_create_questions():
+        try:
+            summary = import_questions(iter_rows(request))
+        except ValueError:
+            abort(400)
+
+        return jsonify({
+            'success': True,
+            'inserted': summary['inserted'],
+            'rejected': summary['rejected'],
+            'errors': summary['errors']
+        }), 200
+
+    """
+    Delete or recategorize many questions at once, selected by ids and/or
+    category and difficulty filters.
+    """
+    @app.route('/questions/bulk-delete', methods=['POST'])
+    def bulk_delete_questions():
+        try:
+            deleted = delete_selection(request.get_json())
+        except (TypeError, ValueError):
+            abort(422)
+
+        return jsonify({
+            'success': True,
+            'deleted': deleted,
+            'total_questions': question_counts.total()
+        })
+
+    @app.route('/questions', methods=['PATCH'])
+    def bulk_update_questions():
+        try:
+            updated = update_selection(request.get_json())
+        except (TypeError, ValueError):
+            abort(422)
+
+        return jsonify({
+            'success': True,
+            'updated': updated
+        })
+
+    """
+    Stream every question as NDJSON or CSV.
+    """
+    @app.route('/questions/export')
+    @read_replica
+    def export_question_bank():
+        format = request.args.get('format', 'ndjson')
+        if format not in EXPORT_FORMATS:
+            abort(400)
+
+        response = Response(
+            stream_with_context(export_questions(format)),
+            mimetype=EXPORT_FORMATS[format])
+        response.headers['Content-Disposition'] = \
+            'attachment; filename=questions.{}'.format(format)
+        return response
+
+    """
+    Suggest completions for the word being typed in the search box.
+    """
+    @app.route('/questions/suggest')
+    @read_replica
+    @conditional('questions')
+    @cached('search')
+    def suggest_words():
+        prefix = request.args.get('prefix', '').strip().lower()
+        limit = request.args.get('limit', SUGGESTIONS_LIMIT, type=int)
+        if not prefix or not 0 < limit <= MAX_SUGGESTIONS_LIMIT:
+            abort(400)
+
+        suggestions = question_index.suggest(prefix, limit)
+
+        return jsonify({
+            'success': True,
+            'suggestions': [{'word': word, 'count': count}
+                            for word, count in suggestions]
+        })
+
     """
     @DONE:
     Create a POST endpoint to get questions based on a search term.
@@ -194,6 +375,42 @@ def create_app(test_config=None):
     Try using the word "title" to start.
     """
 
+    """
+    Search questions with GET so results can be cached, optionally
+    filtered by category and difficulty. POST with a searchTerm body is
+    kept for existing clients.
+    """
+    @app.route('/questions/search', methods=['GET', 'POST'])
+    @read_replica
+    @conditional('questions')
+    @cached('search')
+    def search_question_list():
+        if request.method == 'POST':
+            body = request.get_json() or {}
+            search = body.get('searchTerm', None)
+        else:
+            search = request.args.get('searchTerm', None)
+        category = request.args.get('category', None, type=int)
+        difficulty = request.args.get('difficulty', None, type=int)
+        if not search or not search.strip():
+            abort(400)
+
+        current_questions, total_questions = search_questions(
+            request, search, category, difficulty)
+        if len(current_questions) == 0:
+            abort(404)
+
+        response = jsonify({
+            'success': True,
+            'questions': current_questions,
+            'total_questions': total_questions,
+            'current_category': category
+        })
+        if request.method == 'GET':
+            response.cache_control.public = True
+            response.cache_control.max_age = SEARCH_MAX_AGE
+        return response
+
     """
     @DONE:
     Create a GET endpoint to get questions based on category.
@@ -203,30 +420,33 @@ def create_app(test_config=None):
     category to be shown.
     """
     @app.route('/categories/<int:category_id>/questions')
+    @read_replica
+    @conditional('questions', 'categories')
+    @cached('category:{category_id}')
     def question_by_category(category_id):
         try:
-            categories = Category.query.filter(
-                Category.id == category_id).all()
+            categories = category_cache.mapping()
     # abort 404  if category isn't found
-            if categories is None:
+            if category_id not in categories:
                 abort(404)
-            category_type = []
-            for category in categories:
-                category_type.append(category.type)
 
     # paginate questions
             selection = Question.query.filter(
-                Question.category == category_id).all()
-            current_questions = paginate_questions(request, selection)
+                Question.category == category_id).order_by(Question.id)
+            current_questions, next_cursor = paginate_keyset(
+                request, selection)
 
     # return the results
             return jsonify({
                 'success': True,
-                'totalQuestions': len(selection),
+                'totalQuestions': question_counts.for_category(category_id),
                 'questions': current_questions,
-                'categories': category_type[0],
-                'current_category': category_id
+                'categories': categories[category_id],
+                'current_category': category_id,
+                'next_cursor': next_cursor
             }), 200
+        except HTTPException:
+            raise
         except Exception:
             abort(404)
 
@@ -242,28 +462,111 @@ def create_app(test_config=None):
     and shown whether they were correct or not.
     """
     @app.route('/quizzes', methods=['GET', 'POST'])
+    @read_replica
     def play_quiz():
         try:
             body = request.get_json()
             previous_questions = body.get('previous_questions', None)
             quiz_category = body.get('quiz_category', None)
+            count = body.get('count', None)
 
-            if quiz_category['id'] == 0:
-                questions = Question.query.all()
-            else:
-                questions = Question.query.filter(
-                    Question.category == quiz_category['id']).all()
-            if(questions):
-                question = random.choice(questions)
+            # hand out several questions in one round trip
+            if count is not None:
+                if not 0 < int(count) <= MAX_QUIZ_BATCH:
+                    abort(422)
+                return jsonify({
+                    'success': True,
+                    'questions': random_questions(
+                        quiz_category['id'], previous_questions or [],
+                        int(count)),
+                }), 200
+
+            question = random_question(
+                quiz_category['id'], previous_questions or [])
 
+            # question is null once every question was asked
             return jsonify({
                 'success': True,
-                'question': question.format(),
+                'question': question.format() if question else None,
             }), 200
 
         except Exception:
             abort(422)
     """
+    Quiz sessions shuffle the eligible questions once, then deal them one
+    at a time, so a quiz doesn't resend its previous questions.
+    """
+    @app.route('/quizzes/sessions', methods=['POST'])
+    @read_replica
+    def create_quiz_session():
+        try:
+            body = request.get_json()
+            previous_questions = body.get('previous_questions', None)
+            quiz_category = body.get('quiz_category', None)
+
+            session = QuizSession(shuffled_deck(
+                quiz_category['id'], previous_questions or []))
+        except Exception:
+            abort(422)
+
+        session_id = secrets.token_urlsafe(16)
+        app.config['QUIZ_SESSION_STORE'].set(session_id, session)
+
+        return jsonify({
+            'success': True,
+            'session_id': session_id,
+            'total_questions': session.remaining()
+        }), 201
+
+    @app.route('/quizzes/sessions/<session_id>/next')
+    @read_replica
+    def next_session_question(session_id):
+        store = app.config['QUIZ_SESSION_STORE']
+        session = store.get(session_id)
+        if session is None:
+            abort(404)
+        count = request.args.get('count', None, type=int)
+        if count is not None and not 0 < count <= MAX_QUIZ_BATCH:
+            abort(400)
+
+        if count is not None:
+            questions = deal_questions(session, count)
+            return jsonify({
+                'success': True,
+                'questions': questions,
+                'remaining_questions': session.remaining()
+            })
+
+        question = deal_question(session)
+
+        # question is null once the deck is used up
+        return jsonify({
+            'success': True,
+            'question': question.format() if question else None,
+            'remaining_questions': session.remaining()
+        })
+
+    """
+    Hit, miss and eviction counters of this worker's response cache.
+    """
+    @app.route('/cache/stats')
+    def cache_stats():
+        return jsonify({
+            'success': True,
+            'response_cache': response_cache.stats()
+        })
+
+    """
+    Connection pool counters of this worker's database engine.
+    """
+    @app.route('/pool/stats')
+    def database_pool_stats():
+        return jsonify({
+            'success': True,
+            'database_pool': pool_stats()
+        })
+
+    """
     @DONE:
     Create error handlers for all expected errors
     including 404 and 422.
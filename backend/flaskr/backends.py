@@ -0,0 +1,393 @@
+import pickle
+import socket
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from urllib.parse import urlparse
+
+# default size of an in-process cache backend
+MEMORY_CACHE_BYTES = 32 * 1024 * 1024
+
+# a file backend deletes expired rows once every this many writes
+SQLITE_PURGE_EVERY = 1000
+
+# an in-process backend drops expired counters once it holds this many
+COUNTER_SWEEP_AT = 10000
+
+"""
+Cache backends
+    byte stores shared by the app's caches (responses, quiz sessions).
+    Every backend has the same methods:
+
+        get(key)              -> bytes, or None when missing or expired
+        set(key, value, ttl)  stores bytes, ttl in seconds or None
+        delete(key)
+        touch(key, ttl)       restarts the ttl of a stored value
+        incr(key, amount, ttl)
+                              -> the counter after atomically adding amount
+                                 (1 by default); ttl restarts its expiry
+        stats()               -> dict of backend counters
+"""
+
+"""
+MemoryBackend
+    in-process LRU whose size is accounted in bytes. Fast, but every worker
+    has its own copy. Counters are kept apart from the LRU so they are never
+    evicted, only expired.
+"""
+
+
+class MemoryBackend:
+
+    def __init__(self, max_bytes=MEMORY_CACHE_BYTES):
+        self.max_bytes = max_bytes
+        self.lock = threading.Lock()
+        self.entries = OrderedDict()
+        self.counters = {}
+        self.sweep_at = COUNTER_SWEEP_AT
+        self.size = 0
+        self.evictions = 0
+
+    def get(self, key):
+        with self.lock:
+            counter = self.counter(key)
+            if counter is not None:
+                return str(counter).encode()
+            entry = self.entries.get(key)
+            if entry is None:
+                return None
+            value, expires = entry
+            if expires is not None and expires < time.monotonic():
+                self.drop(key)
+                return None
+            self.entries.move_to_end(key)
+            return value
+
+    def set(self, key, value, ttl=None):
+        size = len(key) + len(value)
+        if size > self.max_bytes:
+            return
+        expires = time.monotonic() + ttl if ttl is not None else None
+        with self.lock:
+            if key in self.entries:
+                self.drop(key)
+            self.entries[key] = (value, expires)
+            self.size += size
+            while self.size > self.max_bytes:
+                self.drop(next(iter(self.entries)))
+                self.evictions += 1
+
+    def drop(self, key):
+        value, expires = self.entries.pop(key)
+        self.size -= len(key) + len(value)
+
+    def delete(self, key):
+        with self.lock:
+            if key in self.entries:
+                self.drop(key)
+
+    def touch(self, key, ttl):
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is not None:
+                self.entries[key] = (entry[0], time.monotonic() + ttl)
+
+    def incr(self, key, amount=1, ttl=None):
+        expires = time.monotonic() + ttl if ttl is not None else None
+        with self.lock:
+            counter = (self.counter(key) or 0) + amount
+            self.counters[key] = (counter, expires)
+            if len(self.counters) >= self.sweep_at:
+                self.sweep()
+            return counter
+
+    def sweep(self):
+        """drops expired counters, with the lock held"""
+        now = time.monotonic()
+        for key in [key for key, (value, expires) in self.counters.items()
+                    if expires is not None and expires < now]:
+            del self.counters[key]
+        self.sweep_at = max(2 * len(self.counters), COUNTER_SWEEP_AT)
+
+    def counter(self, key):
+        """the unexpired value of a counter or None, with the lock held"""
+        counter = self.counters.get(key)
+        if counter is None:
+            return None
+        value, expires = counter
+        if expires is not None and expires < time.monotonic():
+            del self.counters[key]
+            return None
+        return value
+
+    def stats(self):
+        with self.lock:
+            return {
+                'entries': len(self.entries),
+                'bytes': self.size,
+                'max_bytes': self.max_bytes,
+                'evictions': self.evictions
+            }
+
+
+"""
+SQLiteBackend
+    cache in a SQLite file, shared by every worker on one host. WAL mode
+    lets readers proceed while another worker writes.
+"""
+
+
+class SQLiteBackend:
+
+    def __init__(self, path):
+        self.path = path
+        self.local = threading.local()
+        self.writes = 0
+        self.connection().execute(
+            'CREATE TABLE IF NOT EXISTS cache '
+            '(key TEXT PRIMARY KEY, value BLOB, expires REAL)')
+
+    def connection(self):
+        connection = getattr(self.local, 'connection', None)
+        if connection is None:
+            connection = sqlite3.connect(
+                self.path, timeout=5, isolation_level=None)
+            connection.execute('PRAGMA journal_mode=WAL')
+            connection.execute('PRAGMA synchronous=NORMAL')
+            self.local.connection = connection
+        return connection
+
+    def get(self, key):
+        row = self.connection().execute(
+            'SELECT value FROM cache WHERE key = ? '
+            'AND (expires IS NULL OR expires > ?)',
+            (key, time.time())).fetchone()
+        if row is None:
+            return None
+        value = row[0]
+        return str(value).encode() if isinstance(value, int) else value
+
+    def set(self, key, value, ttl=None):
+        expires = time.time() + ttl if ttl is not None else None
+        connection = self.connection()
+        connection.execute(
+            'INSERT OR REPLACE INTO cache (key, value, expires) '
+            'VALUES (?, ?, ?)', (key, value, expires))
+        self.writes += 1
+        if self.writes % SQLITE_PURGE_EVERY == 0:
+            connection.execute(
+                'DELETE FROM cache WHERE expires < ?', (time.time(),))
+
+    def delete(self, key):
+        self.connection().execute('DELETE FROM cache WHERE key = ?', (key,))
+
+    def touch(self, key, ttl):
+        self.connection().execute(
+            'UPDATE cache SET expires = ? WHERE key = ?',
+            (time.time() + ttl, key))
+
+    def incr(self, key, amount=1, ttl=None):
+        expires = time.time() + ttl if ttl is not None else None
+        connection = self.connection()
+        connection.execute('BEGIN IMMEDIATE')
+        try:
+            connection.execute(
+                'DELETE FROM cache WHERE key = ? AND expires < ?',
+                (key, time.time()))
+            connection.execute(
+                'INSERT OR IGNORE INTO cache (key, value, expires) '
+                'VALUES (?, 0, NULL)', (key,))
+            connection.execute(
+                'UPDATE cache SET value = CAST(value AS INTEGER) + ?, '
+                'expires = ? WHERE key = ?', (amount, expires, key))
+            counter = connection.execute(
+                'SELECT value FROM cache WHERE key = ?', (key,)).fetchone()[0]
+            connection.execute('COMMIT')
+        except Exception:
+            connection.execute('ROLLBACK')
+            raise
+        return int(counter)
+
+    def stats(self):
+        entries = self.connection().execute(
+            'SELECT COUNT(*) FROM cache').fetchone()[0]
+        return {'entries': entries}
+
+
+"""
+RespClient
+    minimal client for the Redis protocol (RESP), one connection per thread
+"""
+
+
+class RespClient:
+
+    def __init__(self, host='localhost', port=6379, db=0, timeout=1.0):
+        self.host = host
+        self.port = port
+        self.db = db
+        self.timeout = timeout
+        self.local = threading.local()
+
+    def connection(self):
+        connection = getattr(self.local, 'connection', None)
+        if connection is None:
+            sock = socket.create_connection(
+                (self.host, self.port), timeout=self.timeout)
+            connection = (sock, sock.makefile('rb'))
+            self.local.connection = connection
+            if self.db:
+                self.execute('SELECT', self.db)
+        return connection
+
+    def execute(self, *args):
+        sock, reader = self.connection()
+        parts = [b'*%d\r\n' % len(args)]
+        for arg in args:
+            if not isinstance(arg, bytes):
+                arg = str(arg).encode()
+            parts.append(b'$%d\r\n%s\r\n' % (len(arg), arg))
+        try:
+            sock.sendall(b''.join(parts))
+            return self.read_reply(reader)
+        except (OSError, EOFError):
+            # drop the broken connection, the next command reconnects
+            self.local.connection = None
+            raise
+
+    def read_reply(self, reader):
+        line = reader.readline()
+        if not line:
+            raise EOFError('connection closed')
+        kind, rest = line[:1], line[1:-2]
+        if kind == b'+':
+            return rest
+        if kind == b'-':
+            raise RespError(rest.decode())
+        if kind == b':':
+            return int(rest)
+        if kind == b'$':
+            length = int(rest)
+            if length < 0:
+                return None
+            return reader.read(length + 2)[:-2]
+        if kind == b'*':
+            length = int(rest)
+            if length < 0:
+                return None
+            return [self.read_reply(reader) for _ in range(length)]
+        raise RespError('unexpected reply {!r}'.format(line))
+
+
+class RespError(Exception):
+    pass
+
+
+"""
+RedisBackend
+    cache on a Redis server, shared by every worker that can reach it. Any
+    client with an execute(*args) method speaking Redis commands works,
+    which lets tests use an in-process fake.
+"""
+
+
+class RedisBackend:
+
+    def __init__(self, client):
+        self.client = client
+
+    def get(self, key):
+        return self.client.execute('GET', key)
+
+    def set(self, key, value, ttl=None):
+        if ttl is None:
+            self.client.execute('SET', key, value)
+        else:
+            self.client.execute('SET', key, value, 'PX', int(ttl * 1000))
+
+    def delete(self, key):
+        self.client.execute('DEL', key)
+
+    def touch(self, key, ttl):
+        self.client.execute('PEXPIRE', key, int(ttl * 1000))
+
+    def incr(self, key, amount=1, ttl=None):
+        counter = self.client.execute('INCRBY', key, amount)
+        if ttl is not None:
+            self.client.execute('PEXPIRE', key, int(ttl * 1000))
+        return counter
+
+    def stats(self):
+        return {'entries': self.client.execute('DBSIZE')}
+
+
+"""
+backend_from_url(url)
+    memory://, sqlite:///path/to/cache.db or redis://host:port/db
+"""
+
+
+def backend_from_url(url):
+    parsed = urlparse(url)
+    if parsed.scheme == 'memory':
+        return MemoryBackend()
+    if parsed.scheme == 'sqlite':
+        return SQLiteBackend(parsed.path)
+    if parsed.scheme == 'redis':
+        db = int(parsed.path.lstrip('/') or 0)
+        return RedisBackend(RespClient(
+            parsed.hostname or 'localhost', parsed.port or 6379, db))
+    raise ValueError('unsupported cache url {}'.format(url))
+
+
+"""
+NamespacedCache
+    stores pickled values on a backend under versioned namespaces. Bumping
+    a namespace's version (invalidate) orphans all its keys at once, and
+    bumping the '*' version orphans every namespace; orphans age out by TTL
+    or eviction. key() resolves a key under the current versions, so a
+    caller can load and store under the versions it started from (see
+    load and store). Version counters have no TTL, so a Redis server must
+    not evict keys without one (use a volatile-* maxmemory policy). Values
+    are pickled, so only point it at trusted backends.
+"""
+
+
+class NamespacedCache:
+
+    def __init__(self, backend, prefix):
+        self.backend = backend
+        self.prefix = prefix
+
+    def version(self, namespace):
+        value = self.backend.get(
+            '{}:version:{}'.format(self.prefix, namespace))
+        return int(value) if value is not None else 0
+
+    def key(self, namespace, key):
+        return '{}:{}:{}:{}:{}'.format(
+            self.prefix, self.version('*'), namespace,
+            self.version(namespace), key)
+
+    def get(self, namespace, key):
+        return self.load(self.key(namespace, key))
+
+    def set(self, namespace, key, value, ttl=None):
+        self.store(self.key(namespace, key), value, ttl)
+
+    def load(self, versioned_key):
+        value = self.backend.get(versioned_key)
+        if value is None:
+            return None
+        return pickle.loads(value)
+
+    def store(self, versioned_key, value, ttl=None):
+        self.backend.set(versioned_key,
+                         pickle.dumps(value, pickle.HIGHEST_PROTOCOL), ttl)
+
+    def delete(self, namespace, key):
+        self.backend.delete(self.key(namespace, key))
+
+    def invalidate(self, namespace='*'):
+        self.backend.incr('{}:version:{}'.format(self.prefix, namespace))
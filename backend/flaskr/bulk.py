@@ -0,0 +1,292 @@
+import csv
+import io
+import json
+import re
+
+from sqlalchemy import Integer, any_, bindparam
+from sqlalchemy.dialects.postgresql import ARRAY
+
+from models import db, Question, notify_question_listeners
+from .categories import category_cache
+from .search import filter_questions
+
+# rows validated and inserted per transaction
+BULK_CHUNK_SIZE = 5000
+
+# rejected rows reported back individually, the rest are only counted
+MAX_REPORTED_ERRORS = 100
+
+NDJSON_MIMETYPES = ('application/x-ndjson', 'application/jsonl')
+
+# columns PATCH /questions may set
+UPDATABLE_COLUMNS = ('category', 'difficulty')
+
+"""
+iter_rows(request)
+    the rows of a bulk import body, one at a time. NDJSON bodies are read
+    line by line from the request stream; anything else must be a JSON
+    array. A row that isn't valid JSON is yielded as a ValueError.
+"""
+
+
+def iter_rows(request):
+    if request.mimetype in NDJSON_MIMETYPES:
+        for line in request.stream:
+            line = line.strip()
+            if not line:
+                continue
+            try:
+                yield json.loads(line)
+            except ValueError as error:
+                yield ValueError('invalid JSON: {}'.format(error))
+        return
+
+    body = request.get_json()
+    if not isinstance(body, list):
+        raise ValueError('expected a JSON array or NDJSON')
+    for row in body:
+        yield row
+
+
+"""
+validate_row(row, categories)
+    the (question, answer, category, difficulty) values of a row, raising
+    ValueError with the reason when the row can't be imported
+"""
+
+
+def validate_row(row, categories):
+    if isinstance(row, ValueError):
+        raise row
+    if not isinstance(row, dict):
+        raise ValueError('expected an object')
+    question = row.get('question')
+    answer = row.get('answer')
+    if not isinstance(question, str) or not question.strip():
+        raise ValueError('question is required')
+    if not isinstance(answer, str) or not answer.strip():
+        raise ValueError('answer is required')
+    category = as_integer(row.get('category'))
+    difficulty = as_integer(row.get('difficulty'))
+    if category is None or difficulty is None:
+        raise ValueError('category and difficulty must be integers')
+    if category not in categories:
+        raise ValueError('unknown category {}'.format(category))
+    return question, answer, category, difficulty
+
+
+"""
+as_integer(value)
+    an int or a string of digits as an int, otherwise None. Floats and
+    booleans are refused rather than truncated to 1 or 0.
+"""
+
+
+def as_integer(value):
+    if isinstance(value, bool):
+        return None
+    if isinstance(value, int):
+        return value
+    if isinstance(value, str) and re.fullmatch(r'\s*-?\d+\s*', value):
+        return int(value)
+    return None
+
+
+"""
+insert_chunk(values)
+    inserts validated rows in one transaction, with COPY on Postgres and a
+    single executemany INSERT elsewhere
+"""
+
+
+def insert_chunk(values):
+    connection = db.session.connection()
+    if connection.dialect.name == 'postgresql':
+        buffer = io.StringIO()
+        csv.writer(buffer).writerows(values)
+        buffer.seek(0)
+        cursor = connection.connection.cursor()
+        cursor.copy_expert(
+            'COPY questions (question, answer, category, difficulty) '
+            'FROM STDIN WITH (FORMAT csv)', buffer)
+    else:
+        connection.execute(Question.__table__.insert(), [
+            {'question': question, 'answer': answer,
+             'category': category, 'difficulty': difficulty}
+            for question, answer, category, difficulty in values])
+    db.session.commit()
+
+
+"""
+import_questions(rows)
+    validates and inserts rows chunk by chunk. Invalid rows are rejected
+    one by one; a chunk the database refuses is rejected as a whole.
+    Returns the import summary.
+"""
+
+
+def import_questions(rows, chunk_size=BULK_CHUNK_SIZE):
+    categories = category_cache.mapping()
+    summary = {'inserted': 0, 'rejected': 0, 'errors': []}
+
+    def reject(index, reason):
+        summary['rejected'] += 1
+        if len(summary['errors']) < MAX_REPORTED_ERRORS:
+            summary['errors'].append({'row': index, 'error': reason})
+
+    def flush(chunk, first_index, last_index):
+        try:
+            insert_chunk(chunk)
+            summary['inserted'] += len(chunk)
+        except Exception as error:
+            db.session.rollback()
+            summary['rejected'] += len(chunk)
+            if len(summary['errors']) < MAX_REPORTED_ERRORS:
+                summary['errors'].append({
+                    'rows': [first_index, last_index],
+                    'error': 'database error: {}'.format(
+                        str(error).splitlines()[0])})
+
+    chunk = []
+    first_index = index = 0
+    try:
+        for index, row in enumerate(rows):
+            try:
+                values = validate_row(row, categories)
+            except ValueError as error:
+                reject(index, str(error))
+                continue
+            if not chunk:
+                first_index = index
+            chunk.append(values)
+            if len(chunk) >= chunk_size:
+                flush(chunk, first_index, index)
+                chunk = []
+        if chunk:
+            flush(chunk, first_index, index)
+    finally:
+        if summary['inserted']:
+            notify_question_listeners('bulk', None)
+
+    return summary
+
+
+EXPORT_FORMATS = {
+    'ndjson': 'application/x-ndjson',
+    'csv': 'text/csv'
+}
+
+EXPORT_COLUMNS = ('id', 'question', 'answer', 'category', 'difficulty')
+
+# rows fetched from the cursor and sent to the client at a time
+EXPORT_BATCH_SIZE = 1000
+
+"""
+export_questions(format)
+    yields the whole question bank as NDJSON or CSV text, a batch of rows
+    at a time. Rows are read through a server-side cursor, so memory use
+    doesn't grow with the table.
+"""
+
+
+def export_questions(format, batch_size=EXPORT_BATCH_SIZE):
+    rows = db.session.query(
+        *[getattr(Question, column) for column in EXPORT_COLUMNS]).order_by(
+        Question.id).yield_per(batch_size)
+
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    if format == 'csv':
+        writer.writerow(EXPORT_COLUMNS)
+
+    batched = 0
+    for row in rows:
+        if format == 'csv':
+            writer.writerow(row)
+        else:
+            buffer.write(json.dumps(dict(zip(EXPORT_COLUMNS, row))))
+            buffer.write('\n')
+        batched += 1
+        if batched == batch_size:
+            yield buffer.getvalue()
+            buffer.seek(0)
+            buffer.truncate()
+            batched = 0
+    if buffer.tell():
+        yield buffer.getvalue()
+
+
+"""
+select_questions(body)
+    a query over the questions named by a bulk request body: a list of
+    `ids` and/or `category` and `difficulty` filters. A body selecting
+    nothing raises ValueError rather than selecting every question.
+"""
+
+
+def select_questions(body):
+    if not isinstance(body, dict):
+        raise ValueError('expected an object')
+    ids = body.get('ids', None)
+    category = body.get('category', None)
+    difficulty = body.get('difficulty', None)
+    if ids is None and category is None and difficulty is None:
+        raise ValueError('select questions by ids, category or difficulty')
+
+    query = Question.query
+    if ids is not None:
+        if not isinstance(ids, list) or not ids:
+            raise ValueError('ids must be a non-empty list')
+        query = query.filter(id_in([int(question_id) for question_id in ids]))
+    return filter_questions(
+        query,
+        int(category) if category is not None else None,
+        int(difficulty) if difficulty is not None else None)
+
+
+"""
+id_in(ids)
+    `id = ANY(:ids)` with the ids bound as one array on Postgres, so the
+    statement doesn't grow a parameter per id; IN (...) elsewhere
+"""
+
+
+def id_in(ids):
+    if db.session.get_bind().dialect.name == 'postgresql':
+        return Question.id == any_(
+            bindparam('ids', ids, type_=ARRAY(Integer)))
+    return Question.id.in_(ids)
+
+
+"""
+delete_questions(body) / update_questions(body)
+    delete or update every selected question with one set-based statement
+    and one commit, then notify listeners once. Return the affected count.
+"""
+
+
+def delete_questions(body):
+    deleted = select_questions(body).delete(synchronize_session=False)
+    db.session.commit()
+    if deleted:
+        notify_question_listeners('bulk', None)
+    return deleted
+
+
+def update_questions(body):
+    changes = body.get('set', None) if isinstance(body, dict) else None
+    if not isinstance(changes, dict) or not changes or \
+            not set(changes) <= set(UPDATABLE_COLUMNS):
+        raise ValueError('set may change {}'.format(
+            ' and '.join(UPDATABLE_COLUMNS)))
+    changes = {column: int(value) for column, value in changes.items()}
+    if 'category' in changes and \
+            changes['category'] not in category_cache.mapping():
+        raise ValueError('unknown category {}'.format(changes['category']))
+
+    updated = select_questions(body).update(
+        changes, synchronize_session=False)
+    db.session.commit()
+    if updated:
+        notify_question_listeners('bulk', None)
+    return updated
@@ -0,0 +1,183 @@
+import threading
+import time
+from functools import wraps
+from urllib.parse import urlencode
+
+from flask import Response, make_response, request
+
+from models import question_listeners, category_listeners
+from .backends import MemoryBackend, NamespacedCache
+from .counts import category_key
+from .extensions import app_local, app_listener
+from .replicas import reads_own_writes
+from .singleflight import SingleFlight
+
+# seconds a cached response is served, which bounds how long writes made
+# by other workers can go unseen on a per-process backend
+RESPONSE_CACHE_TTL = 30
+
+# seconds an expired response may still be served while one request
+# rebuilds it; 0 disables stale-while-revalidate
+RESPONSE_CACHE_STALE_TTL = 0
+
+# response headers stored with a cached body
+CACHED_HEADERS = ('Cache-Control',)
+
+"""
+ResponseCache
+    serialized GET response bodies on a cache backend (see backends.py).
+    Each entry belongs to a namespace naming what it was built from, so a
+    write drops only the namespaces it affects by bumping their version.
+    Entries are addressed by key(namespace, key), resolved before the
+    response is built, so a response built while a write committed is
+    stored under the old version and never served after the write.
+    Entries are fresh for ttl seconds and kept stale_ttl seconds longer.
+"""
+
+
+class ResponseCache:
+
+    def __init__(self, backend=None, ttl=RESPONSE_CACHE_TTL,
+                 stale_ttl=RESPONSE_CACHE_STALE_TTL):
+        self.ttl = ttl
+        self.stale_ttl = stale_ttl
+        self.lock = threading.Lock()
+        self.flight = SingleFlight()
+        self.use(backend or MemoryBackend())
+
+    def use(self, backend):
+        with self.lock:
+            self.backend = backend
+            self.cache = NamespacedCache(backend, 'responses')
+            self.hits = 0
+            self.stale_hits = 0
+            self.misses = 0
+            self.invalidations = 0
+
+    def key(self, namespace, key):
+        return self.cache.key(namespace, key)
+
+    def get(self, entry_key):
+        """the cached (body, headers, fresh) or None"""
+        entry = self.cache.load(entry_key)
+        if entry is None:
+            return None
+        body, headers, fresh_until = entry
+        return body, headers, fresh_until > time.time()
+
+    def set(self, entry_key, body, headers=()):
+        self.cache.store(entry_key,
+                         (body, tuple(headers), time.time() + self.ttl),
+                         self.ttl + self.stale_ttl)
+
+    def count(self, counter):
+        with self.lock:
+            setattr(self, counter, getattr(self, counter) + 1)
+
+    def invalidate(self, *namespaces):
+        for namespace in namespaces:
+            self.cache.invalidate(namespace)
+        with self.lock:
+            self.invalidations += len(namespaces)
+
+    def clear(self):
+        self.invalidate('*')
+
+    def on_question_change(self, action, question):
+        """Question writes drop every /questions page, since each page
+        carries the total, plus the listings of the question's category and
+        search results. Updates may have moved a question between
+        categories, and categories are part of every listing, so those and
+        bulk writes clear the cache."""
+        if action in ('update', 'bulk'):
+            self.clear()
+            return
+        self.invalidate(
+            'questions', 'category:{}'.format(category_key(question.category)),
+            'search')
+
+    def on_category_change(self, action, category):
+        self.clear()
+
+    def stats(self):
+        stats = dict(self.backend.stats())
+        with self.lock:
+            stats.update({
+                'backend': type(self.backend).__name__,
+                'hits': self.hits,
+                'stale_hits': self.stale_hits,
+                'misses': self.misses,
+                'coalesced': self.flight.coalesced,
+                'invalidations': self.invalidations
+            })
+        return stats
+
+
+response_cache = app_local('response_cache')
+question_listeners.append(
+    app_listener('response_cache', 'on_question_change'))
+category_listeners.append(
+    app_listener('response_cache', 'on_category_change'))
+
+"""
+cache_key()
+    the current route with its query arguments in a normalized order
+"""
+
+
+def cache_key():
+    args = sorted(request.args.items(multi=True))
+    return '{}?{}'.format(request.path, urlencode(args))
+
+
+"""
+cached(namespace)
+    decorates a read endpoint so its successful GET responses are served
+    from the response cache. The namespace may name view arguments, e.g.
+    'category:{category_id}'. Concurrent misses for the same response share
+    one run of the view, and while an expired entry is being rebuilt other
+    requests are served the stale copy if the cache keeps one. Clients that
+    just wrote are answered by the view, see replicas.py.
+"""
+
+
+def cached(namespace):
+    def decorator(view):
+        @wraps(view)
+        def wrapper(*args, **kwargs):
+            if request.method != 'GET' or reads_own_writes():
+                return view(*args, **kwargs)
+
+            # the versions are read once, before the view runs
+            entry_key = response_cache.key(
+                namespace.format(**kwargs), cache_key())
+            entry = response_cache.get(entry_key)
+            if entry is not None:
+                body, headers, fresh = entry
+                if fresh:
+                    response_cache.count('hits')
+                    return cached_response(200, body, headers)
+                if response_cache.flight.in_flight(entry_key):
+                    response_cache.count('stale_hits')
+                    return cached_response(200, body, headers)
+            response_cache.count('misses')
+
+            def load():
+                response = make_response(view(*args, **kwargs))
+                body = response.get_data()
+                headers = tuple((name, response.headers[name])
+                                for name in CACHED_HEADERS
+                                if name in response.headers)
+                if response.status_code == 200:
+                    response_cache.set(entry_key, body, headers)
+                return response.status_code, body, headers
+
+            status, body, headers = response_cache.flight.do(entry_key, load)
+            return cached_response(status, body, headers)
+        return wrapper
+    return decorator
+
+
+def cached_response(status, body, headers):
+    return Response(body, status=status, mimetype='application/json',
+                    headers=list(headers))
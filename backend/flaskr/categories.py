@@ -0,0 +1,87 @@
+import hashlib
+import json
+import threading
+import time
+from types import MappingProxyType
+
+from models import Category, category_listeners
+from .extensions import app_local, app_listener
+from .replicas import reads_own_writes
+from .snapshots import SNAPSHOT_TTL, fresh
+
+# categories hardly ever change, so their snapshot lives longer
+CATEGORIES_TTL = 5 * SNAPSHOT_TTL
+
+# seconds clients may reuse GET /categories before revalidating its ETag
+CATEGORIES_MAX_AGE = 60
+
+"""
+CategoryCache
+    the {id: type} map of every category, read once and shared by all
+    endpoints, together with the JSON body of GET /categories. Category
+    writes bump a version counter, which makes the next read reload.
+    Clients that just wrote read the table, see replicas.py.
+"""
+
+
+class CategoryCache:
+
+    def __init__(self, ttl=CATEGORIES_TTL):
+        self.ttl = ttl
+        self.lock = threading.Lock()
+        self.version = 0
+        self.entry = None
+
+    def bump(self, action=None, category=None):
+        with self.lock:
+            self.version += 1
+
+    def load(self, version):
+        categories = Category.query.order_by(Category.id).all()
+        mapping = MappingProxyType(
+            {category.id: category.type for category in categories})
+        body = json.dumps({
+            'success': True,
+            'categories': dict(mapping)
+        }).encode()
+        return CategoryEntry(version, mapping, body)
+
+    def get(self):
+        with self.lock:
+            version = self.version
+            entry = self.entry
+        if reads_own_writes():
+            return self.load(version)
+        if entry is not None and entry.version == version and \
+                fresh(entry.loaded_at, self.ttl):
+            return entry
+        entry = self.load(version)
+        with self.lock:
+            # keep the newest entry if a write raced with the reload
+            if self.version == version:
+                self.entry = entry
+        return entry
+
+    def mapping(self):
+        return self.get().mapping
+
+
+"""
+CategoryEntry
+    one loaded version of the categories: the read-only map, its
+    serialized GET /categories body and a strong ETag of that body
+"""
+
+
+class CategoryEntry:
+
+    def __init__(self, version, mapping, body):
+        self.version = version
+        self.mapping = mapping
+        self.body = body
+        self.etag = hashlib.sha1(body).hexdigest()
+        self.loaded_at = time.monotonic()
+
+
+category_cache = app_local('category_cache')
+category_listeners.append(app_listener('category_cache', 'bump'))
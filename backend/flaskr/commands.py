@@ -0,0 +1,58 @@
+import click
+from flask.cli import AppGroup
+
+import migrations
+from models import db
+
+db_cli = AppGroup('db', help='Manage the database schema.')
+
+"""
+flask db upgrade [revision]
+    applies the migrations the database is missing, up to the head or the
+    given revision
+"""
+
+
+@db_cli.command('upgrade')
+@click.argument('revision', required=False)
+def upgrade(revision):
+    try:
+        applied = migrations.upgrade(db.engine, revision)
+    except migrations.MigrationError as error:
+        raise click.ClickException(str(error))
+    for applied_revision in applied:
+        click.echo('applied {}'.format(applied_revision))
+    if not applied:
+        click.echo('already up to date')
+
+
+"""
+flask db downgrade [revision]
+    reverts the latest migration, or every migration after the given
+    revision
+"""
+
+
+@db_cli.command('downgrade')
+@click.argument('revision', required=False)
+def downgrade(revision):
+    try:
+        reverted = migrations.downgrade(db.engine, revision)
+    except migrations.MigrationError as error:
+        raise click.ClickException(str(error))
+    for reverted_revision in reverted:
+        click.echo('reverted {}'.format(reverted_revision))
+
+
+"""
+flask db current
+    the revision the database is at, and the latest one shipped
+"""
+
+
+@db_cli.command('current')
+def current():
+    with db.engine.connect() as connection:
+        revision = migrations.current_revision(connection)
+    click.echo('current: {}'.format(revision or 'none'))
+    click.echo('head: {}'.format(migrations.head()))
@@ -0,0 +1,113 @@
+import hashlib
+import os
+import time
+from functools import wraps
+
+from flask import Response, make_response, request
+
+from models import question_listeners, category_listeners
+from .backends import MemoryBackend
+from .extensions import app_local, app_listener
+from .replicas import reads_own_writes
+
+# with an in-process cache backend, local writes are seen at once but
+# writes made by other workers only change a version when its epoch rolls
+# over, after at most this long
+VERSION_TTL = 60
+
+"""
+TableVersions
+    a modification counter per table, bumped by the model write hooks and
+    kept on the cache backend (see backends.py) with incr. On a shared
+    backend every worker sees the same counters. On an in-process backend
+    they are only meaningful inside one process, so the token also carries
+    a per-process id and the current TTL epoch. The time of the last bump
+    is kept next to the counters, see written_within.
+"""
+
+
+class TableVersions:
+
+    def __init__(self, backend=None, shared=False, ttl=VERSION_TTL):
+        self.ttl = ttl
+        self.process = os.urandom(4).hex()
+        self.backend = backend or MemoryBackend()
+        self.shared = shared
+
+    def key(self, table):
+        return 'table-versions:{}'.format(table)
+
+    def bump(self, table):
+        self.backend.incr(self.key(table))
+        self.backend.set(self.key('written_at'), str(time.time()).encode())
+
+    def written_within(self, seconds):
+        """whether any table was bumped in the last seconds"""
+        written_at = self.backend.get(self.key('written_at'))
+        return written_at is not None and \
+            float(written_at) > time.time() - seconds
+
+    def version(self, table):
+        value = self.backend.get(self.key(table))
+        return int(value) if value is not None else 0
+
+    def token(self, tables):
+        counters = '.'.join(str(self.version(table)) for table in tables)
+        if self.shared:
+            return counters
+        epoch = int(time.monotonic() // self.ttl)
+        return '{}.{}.{}'.format(self.process, epoch, counters)
+
+    def on_question_change(self, action, question):
+        self.bump('questions')
+
+    def on_category_change(self, action, category):
+        self.bump('categories')
+
+
+table_versions = app_local('table_versions')
+question_listeners.append(
+    app_listener('table_versions', 'on_question_change'))
+category_listeners.append(
+    app_listener('table_versions', 'on_category_change'))
+
+"""
+request_etag(tables)
+    a weak ETag for the current GET request, derived from the versions of
+    the tables its response is built from, the path and the query string
+"""
+
+
+def request_etag(tables):
+    args = sorted(request.args.items(multi=True))
+    digest = hashlib.sha1(repr((request.path, args)).encode()).hexdigest()
+    return '{}.{}'.format(table_versions.token(tables), digest[:16])
+
+
+"""
+conditional(*tables)
+    decorates a read endpoint with a weak ETag and answers a matching
+    If-None-Match with 304 before the view, so the database isn't touched.
+    Clients that just wrote get no ETag, see replicas.py.
+"""
+
+
+def conditional(*tables):
+    def decorator(view):
+        @wraps(view)
+        def wrapper(*args, **kwargs):
+            if request.method != 'GET' or reads_own_writes():
+                return view(*args, **kwargs)
+
+            etag = request_etag(tables)
+            if request.if_none_match.contains_weak(etag):
+                response = Response(status=304)
+                response.set_etag(etag, weak=True)
+                return response
+
+            response = make_response(view(*args, **kwargs))
+            if response.status_code == 200:
+                response.set_etag(etag, weak=True)
+            return response
+        return wrapper
+    return decorator
@@ -0,0 +1,136 @@
+import threading
+import time
+
+from sqlalchemy import func, text
+
+from models import db, Question, question_listeners
+from .extensions import app_local, app_listener
+from .replicas import reads_own_writes
+from .snapshots import SNAPSHOT_TTL, fresh, drops_snapshots
+
+# tables with more rows than this report the planner's estimate as their
+# total instead of summing an exact GROUP BY over the whole table
+ESTIMATE_TOTAL_ABOVE = 1000000
+
+"""
+category_key(category)
+    normalizes a category value to the int used as a counts key
+"""
+
+
+def category_key(category):
+    try:
+        return int(category)
+    except (TypeError, ValueError):
+        return None
+
+
+"""
+QuestionCounts
+    exact per-category question counts, loaded with one GROUP BY and then
+    kept current by Question.insert/delete instead of re-counting per request.
+    Clients that just wrote are counted from the table, see replicas.py.
+    Every write bumps a generation counter, and a load is only kept if no
+    write happened while it ran.
+"""
+
+
+class QuestionCounts:
+
+    def __init__(self, ttl=SNAPSHOT_TTL):
+        self.ttl = ttl
+        self.lock = threading.Lock()
+        self.counts = None
+        self.generation = 0
+        self.loaded_at = None
+        self.estimate = None
+        self.estimated_at = None
+
+    def invalidate(self):
+        with self.lock:
+            self.counts = None
+            self.generation += 1
+
+    def load(self):
+        rows = db.session.query(
+            Question.category, func.count(Question.id)).group_by(
+            Question.category).all()
+        counts = {}
+        for category, count in rows:
+            key = category_key(category)
+            counts[key] = counts.get(key, 0) + count
+        return counts
+
+    def snapshot(self):
+        if reads_own_writes():
+            return self.load()
+        with self.lock:
+            counts = self.counts
+            if counts is not None and fresh(self.loaded_at, self.ttl):
+                return counts
+            generation = self.generation
+        counts = self.load()
+        with self.lock:
+            # a write during the load may be missing from it
+            if self.generation == generation:
+                self.counts = counts
+                self.loaded_at = time.monotonic()
+        return counts
+
+    def on_change(self, action, question):
+        if drops_snapshots(action):
+            self.invalidate()
+            return
+        step = 1 if action == 'insert' else -1
+        key = category_key(question.category)
+        with self.lock:
+            self.generation += 1
+            if self.counts is not None:
+                counts = dict(self.counts)
+                counts[key] = max(counts.get(key, 0) + step, 0)
+                self.counts = counts
+
+    def for_category(self, category_id):
+        return self.snapshot().get(category_key(category_id), 0)
+
+    def total(self, exact=False):
+        if exact:
+            return db.session.query(func.count(Question.id)).scalar()
+        estimate = self.table_estimate()
+        if estimate is not None and estimate > ESTIMATE_TOTAL_ABOVE:
+            return estimate
+        return sum(self.snapshot().values())
+
+    def table_estimate(self):
+        """the planner's row estimate, re-read once per ttl"""
+        with self.lock:
+            if fresh(self.estimated_at, self.ttl):
+                return self.estimate
+        estimate = estimate_rows(Question.__tablename__)
+        with self.lock:
+            self.estimate = estimate
+            self.estimated_at = time.monotonic()
+        return estimate
+
+
+"""
+estimate_rows(table_name)
+    the planner's row estimate from pg_class.reltuples, or None when the
+    database is not Postgres or the table was never analyzed
+"""
+
+
+def estimate_rows(table_name):
+    if db.session.get_bind().dialect.name != 'postgresql':
+        return None
+    estimate = db.session.execute(
+        text('SELECT reltuples::bigint FROM pg_class '
+             'WHERE oid = to_regclass(:name)'),
+        {'name': table_name}).scalar()
+    if estimate is None or estimate <= 0:
+        return None
+    return estimate
+
+
+question_counts = app_local('question_counts')
+question_listeners.append(app_listener('question_counts', 'on_change'))
@@ -0,0 +1,28 @@
+from flask import current_app
+from werkzeug.local import LocalProxy
+
+"""
+app_local(name)
+    a proxy to the current app's app.extensions[name]. create_app gives
+    every app its own in-process caches, so two apps in one process (or
+    one test and the next) never see each other's snapshots.
+"""
+
+
+def app_local(name):
+    return LocalProxy(lambda: current_app.extensions[name])
+
+
+"""
+app_listener(name, method)
+    a model write listener calling method on the current app's
+    app.extensions[name], if the app has one
+"""
+
+
+def app_listener(name, method):
+    def listener(action, row):
+        instance = current_app.extensions.get(name)
+        if instance is not None:
+            getattr(instance, method)(action, row)
+    return listener
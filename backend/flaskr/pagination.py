@@ -0,0 +1,108 @@
+import base64
+import binascii
+
+from flask import abort
+from sqlalchemy import func
+
+from models import Question
+
+QUESTIONS_PER_PAGE = 10
+
+"""
+paginate_questions(request, query)
+    applies the requested page to a query as LIMIT/OFFSET and formats
+    only the rows of that page
+"""
+
+
+def paginate_questions(request, query, per_page=QUESTIONS_PER_PAGE):
+    page = request.args.get('page', 1, type=int)
+    if page < 1:
+        return []
+    start = (page - 1) * per_page
+
+    # let the database skip to the page instead of loading every row
+    rows = query.limit(per_page).offset(start).all()
+
+    return [row.format() for row in rows]
+
+
+"""
+encode_cursor(last_id) / decode_cursor(cursor)
+    an opaque cursor is the url-safe base64 of the last id a client has seen
+"""
+
+
+def encode_cursor(last_id):
+    return base64.urlsafe_b64encode(
+        str(last_id).encode()).decode().rstrip('=')
+
+
+def decode_cursor(cursor):
+    try:
+        padded = cursor + '=' * (-len(cursor) % 4)
+        return int(base64.urlsafe_b64decode(padded.encode()).decode())
+    except (binascii.Error, UnicodeDecodeError, ValueError):
+        abort(400)
+
+
+"""
+paginate_keyset(request, query)
+    pages an id-ordered query by `cursor` (or a plain `after_id`) with
+    `id > last_seen_id LIMIT n`, so deep pages cost the same as the first.
+    Without a cursor it falls back to `page`. Returns the formatted rows and
+    the cursor of the next page, or None on the last page.
+"""
+
+
+def paginate_keyset(request, query, per_page=QUESTIONS_PER_PAGE):
+    entity = query.column_descriptions[0]['entity']
+    cursor = request.args.get('cursor', None)
+    after_id = request.args.get('after_id', None, type=int)
+
+    if cursor is not None:
+        after_id = decode_cursor(cursor)
+
+    if after_id is not None:
+        query = query.filter(entity.id > after_id)
+    else:
+        page = request.args.get('page', 1, type=int)
+        if page < 1:
+            return [], None
+        query = query.offset((page - 1) * per_page)
+
+    # fetch one extra row to know whether another page exists
+    rows = query.limit(per_page + 1).all()
+    next_cursor = None
+    if len(rows) > per_page:
+        rows = rows[:per_page]
+        next_cursor = encode_cursor(rows[-1].id)
+
+    return [row.format() for row in rows], next_cursor
+
+
+"""
+count_rows(query)
+    counts the rows matched by a query with a single COUNT(*)
+"""
+
+
+def count_rows(query):
+    entity = query.column_descriptions[0]['entity']
+    return query.order_by(None).with_entities(func.count(entity.id)).scalar()
+
+
+"""
+hydrate_questions(ids)
+    formats the questions with the given ids in one IN (...) query,
+    keeping the order of ids
+"""
+
+
+def hydrate_questions(ids):
+    if not ids:
+        return []
+    questions = Question.query.filter(Question.id.in_(ids)).all()
+    by_id = {question.id: question for question in questions}
+    return [by_id[question_id].format()
+            for question_id in ids if question_id in by_id]
@@ -0,0 +1,202 @@
+import random
+import threading
+import time
+from array import array
+from bisect import bisect_left
+
+from models import db, Question, question_listeners
+from .counts import category_key
+from .extensions import app_local, app_listener
+from .pagination import hydrate_questions
+from .replicas import reads_own_writes
+from .snapshots import SNAPSHOT_TTL, fresh, drops_snapshots
+
+# pool key for quizzes over every category
+ALL_CATEGORIES = 0
+
+# draw random ids while less than this fraction of a pool was already
+# asked, otherwise list the remaining ids
+MAX_SAMPLED_FRACTION = 0.5
+SAMPLE_TRIES = 8
+
+# most questions handed out by one quiz request
+MAX_QUIZ_BATCH = 50
+
+"""
+QuestionPools
+    sorted array('I') of question ids per quiz category, so picking a random
+    question is an index into an array and one primary-key lookup instead of
+    loading the whole category. Kept current by Question.insert/update/delete.
+    Clients that just wrote get their pool from the table, see replicas.py.
+    As with QuestionCounts, a loaded pool is only kept if no write happened
+    while it was read.
+"""
+
+
+class QuestionPools:
+
+    def __init__(self, ttl=SNAPSHOT_TTL):
+        self.ttl = ttl
+        self.lock = threading.Lock()
+        self.pools = {}
+        self.generation = 0
+
+    def load(self, category):
+        query = db.session.query(Question.id)
+        if category != ALL_CATEGORIES:
+            query = query.filter(Question.category == category)
+        return array('I', (question_id for question_id,
+                           in query.order_by(Question.id)))
+
+    def ids(self, category):
+        category = category_key(category) or ALL_CATEGORIES
+        if reads_own_writes():
+            return self.load(category)
+        with self.lock:
+            pool = self.pools.get(category)
+            if pool is not None and fresh(pool[1], self.ttl):
+                return pool[0]
+            generation = self.generation
+        ids = self.load(category)
+        with self.lock:
+            if self.generation == generation:
+                self.pools[category] = (ids, time.monotonic())
+        return ids
+
+    def invalidate(self):
+        with self.lock:
+            self.pools = {}
+            self.generation += 1
+
+    def on_change(self, action, question):
+        if drops_snapshots(action):
+            self.invalidate()
+            return
+        keys = (ALL_CATEGORIES, category_key(question.category))
+        with self.lock:
+            self.generation += 1
+            for key in keys:
+                pool = self.pools.get(key)
+                if pool is None:
+                    continue
+                # copy on write, readers may hold the previous array
+                ids = array('I', pool[0])
+                position = bisect_left(ids, question.id)
+                present = position < len(ids) and ids[position] == question.id
+                if action == 'insert' and not present:
+                    ids.insert(position, question.id)
+                elif action == 'delete' and present:
+                    ids.pop(position)
+                self.pools[key] = (ids, pool[1])
+
+
+question_pools = app_local('question_pools')
+question_listeners.append(app_listener('question_pools', 'on_change'))
+
+"""
+random_question(category, previous_questions)
+    a random question of a category (or of all categories for 0) that is
+    not one of previous_questions, fetched by primary key, or None when
+    the category has no questions left
+"""
+
+
+def random_question(category, previous_questions=(), attempts=3):
+    excluded = {int(question_id) for question_id in previous_questions}
+    for _ in range(attempts):
+        question_id = pick_id(question_pools.ids(category), excluded)
+        if question_id is None:
+            return None
+        question = Question.query.get(question_id)
+        if question is not None:
+            return question
+        # deleted by another worker since the pool was loaded
+        question_pools.invalidate()
+    return None
+
+
+"""
+random_questions(category, previous_questions, count)
+    up to count distinct random questions of a category that are not among
+    previous_questions, loaded in one IN (...) query
+"""
+
+
+def random_questions(category, previous_questions=(), count=1):
+    excluded = {int(question_id) for question_id in previous_questions}
+    ids = pick_ids(question_pools.ids(category), excluded, count)
+    return hydrate_questions(ids)
+
+
+"""
+pick_ids(ids, excluded, count)
+    up to count distinct random ids of ids that are not in excluded. While
+    few ids are excluded, ids are drawn until enough are new; once a quiz
+    has used up much of the pool, the remaining ids are listed and sampled.
+"""
+
+
+def pick_ids(ids, excluded, count, tries=SAMPLE_TRIES):
+    picked = []
+    if not ids or count < 1:
+        return picked
+    if len(excluded) + count < len(ids) * MAX_SAMPLED_FRACTION:
+        excluded = set(excluded)
+        for _ in range(count * tries):
+            question_id = random.choice(ids)
+            if question_id not in excluded:
+                excluded.add(question_id)
+                picked.append(question_id)
+                if len(picked) == count:
+                    return picked
+    remaining = [question_id for question_id in ids
+                 if question_id not in excluded and question_id not in picked]
+    return picked + random.sample(
+        remaining, min(count - len(picked), len(remaining)))
+
+
+def pick_id(ids, excluded):
+    picked = pick_ids(ids, excluded, 1)
+    return picked[0] if picked else None
+
+
+"""
+shuffled_deck(category, previous_questions)
+    the ids of a category that were not asked yet, shuffled once for a
+    quiz session
+"""
+
+
+def shuffled_deck(category, previous_questions=()):
+    excluded = {int(question_id) for question_id in previous_questions}
+    deck = [question_id for question_id in question_pools.ids(category)
+            if question_id not in excluded]
+    random.shuffle(deck)
+    return array('I', deck)
+
+
+"""
+deal_question(session)
+    the session's next question by primary key, skipping questions deleted
+    since the deck was shuffled, or None at the end of the deck
+"""
+
+
+def deal_question(session):
+    while True:
+        question_id = session.deal()
+        if question_id is None:
+            return None
+        question = Question.query.get(question_id)
+        if question is not None:
+            return question
+
+
+"""
+deal_questions(session, count)
+    the session's next count questions, loaded in one IN (...) query
+"""
+
+
+def deal_questions(session, count):
+    return hydrate_questions(session.deal_many(count))
@@ -0,0 +1,83 @@
+import time
+from functools import wraps
+
+from flask import current_app, g, has_request_context, request
+
+# seconds after a write during which the writer's reads stay on the
+# primary, so they don't miss the write while replicas catch up
+READ_YOUR_WRITES_WINDOW = 5
+
+PRIMARY_COOKIE = 'read_primary_until'
+
+"""
+read_replica
+    decorates a read-only endpoint so its queries may run on a read
+    replica, unless the client wrote within READ_YOUR_WRITES_WINDOW or
+    anyone wrote that recently. Reads are cached and tagged with the table
+    versions bumped on the primary, so a lagging replica must not answer
+    them until it has caught up with the write.
+"""
+
+
+def read_replica(view):
+    @wraps(view)
+    def wrapper(*args, **kwargs):
+        mark_read_only()
+        return view(*args, **kwargs)
+    return wrapper
+
+
+"""
+mark_read_only()
+    flags the current request as a read, for views that only read on some
+    requests: it may run on a replica and doesn't set the write cookie
+"""
+
+
+def mark_read_only():
+    g.read_only = True
+    g.read_replica = not wrote_recently() and not replicas_behind()
+
+
+def replicas_behind():
+    if current_app.extensions.get('replica_router') is None:
+        return False
+    versions = current_app.extensions.get('table_versions')
+    return versions is not None and versions.written_within(
+        current_app.config['READ_YOUR_WRITES_WINDOW'])
+
+
+def wrote_recently():
+    try:
+        return float(request.cookies.get(PRIMARY_COOKIE, 0)) > time.time()
+    except ValueError:
+        return False
+
+
+"""
+reads_own_writes()
+    whether the current request comes from a client that wrote within
+    READ_YOUR_WRITES_WINDOW. Its reads skip the caches, which may still
+    hold what a replica or another worker returned before the write.
+"""
+
+
+def reads_own_writes():
+    return has_request_context() and wrote_recently()
+
+
+"""
+remember_write(response)
+    after a successful write, sends the client a short-lived cookie that
+    keeps its reads on the primary
+"""
+
+
+def remember_write(response):
+    if request.method in ('GET', 'HEAD', 'OPTIONS') or \
+            g.get('read_only') or response.status_code >= 400:
+        return response
+    window = current_app.config['READ_YOUR_WRITES_WINDOW']
+    response.set_cookie(PRIMARY_COOKIE, str(time.time() + window),
+                        max_age=window, httponly=True)
+    return response
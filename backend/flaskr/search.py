@@ -0,0 +1,403 @@
+import re
+import sys
+import threading
+import time
+from contextlib import contextmanager
+from array import array
+from bisect import bisect_left, insort
+from heapq import nlargest
+
+from flask import current_app
+from sqlalchemy import func, literal_column
+
+from models import db, Question, question_listeners
+from .counts import category_key
+from .extensions import app_local, app_listener
+from .pagination import (QUESTIONS_PER_PAGE, paginate_questions,
+                         count_rows, hydrate_questions)
+from .replicas import reads_own_writes
+from .snapshots import SNAPSHOT_TTL, fresh
+
+# must match the expression of the questions_question_fts index
+SEARCH_CONFIG = literal_column("'english'")
+
+TOKEN_PATTERN = re.compile(r'\w+')
+
+SUGGESTIONS_LIMIT = 10
+MAX_SUGGESTIONS_LIMIT = 50
+
+# seconds intermediaries may cache a GET /questions/search response
+SEARCH_MAX_AGE = 60
+
+# seconds before the in-process index is rebuilt from the whole table
+SEARCH_INDEX_TTL = 60 * 60
+
+"""
+tokenize(text)
+    lower-cased word tokens of a question or a search term
+"""
+
+
+def tokenize(text):
+    return TOKEN_PATTERN.findall((text or '').lower())
+
+
+"""
+InvertedIndex
+    in-process token -> question ids index. Each posting list is a sorted
+    array('I') of ids, so a token costs 4 bytes per question that uses it.
+    Every question's tokens are kept with its category and difficulty, so
+    search narrows matches without going back to the table.
+    It is built from the questions table at startup (or on first use) and
+    kept current by Question.insert/update/delete. Once older than
+    catch_up_ttl (see snapshots.py) it catches up with other workers'
+    writes in the background: it reads questions above the highest indexed
+    id and, when the table holds fewer rows than the index, drops deleted
+    ids. Edits made through other workers wait for the full rebuild after
+    ttl. The current postings keep being served meanwhile. A sorted
+    vocabulary of every indexed token backs prefix suggestions.
+"""
+
+
+class InvertedIndex:
+
+    def __init__(self, ttl=SEARCH_INDEX_TTL, catch_up_ttl=SNAPSHOT_TTL):
+        self.ttl = ttl
+        self.catch_up_ttl = catch_up_ttl
+        self.lock = threading.Lock()
+        self.build_lock = threading.Lock()
+        self.postings = None
+        self.documents = {}
+        self.vocabulary = []
+        self.last_id = 0
+        self.built_at = None
+        self.caught_up_at = None
+        self.refreshing = False
+        # writes made while a build reads the table, replayed onto it
+        self.changes = None
+
+    def build(self):
+        with self.build_lock:
+            self.build_locked()
+
+    def build_if_missing(self):
+        with self.build_lock:
+            if self.postings is None:
+                self.build_locked()
+
+    def build_locked(self):
+        with self.lock:
+            self.changes = []
+        started = time.monotonic()
+        try:
+            postings, documents, vocabulary = self.load()
+        except BaseException:
+            with self.lock:
+                self.changes = None
+            raise
+        with self.lock:
+            changes, self.changes = self.changes, None
+            if any(action == 'bulk' for action, _, _ in changes):
+                # the table may have changed under the read, start over
+                self.postings = None
+                return
+            self.postings = postings
+            self.documents = documents
+            self.vocabulary = vocabulary
+            self.last_id = max(documents, default=0)
+            self.built_at = self.caught_up_at = started
+            self.replay(changes)
+
+    def catch_up(self):
+        with self.build_lock:
+            with self.lock:
+                if self.postings is None:
+                    return
+                last_id = self.last_id
+                indexed = len(self.documents)
+                self.changes = []
+            started = time.monotonic()
+            try:
+                rows, ids = self.load_since(last_id, indexed)
+            except BaseException:
+                with self.lock:
+                    self.changes = None
+                raise
+            with self.lock:
+                changes, self.changes = self.changes, None
+                if self.postings is None or \
+                        any(action == 'bulk' for action, _, _ in changes):
+                    self.postings = None
+                    return
+                for question_id, *fields in rows:
+                    if question_id not in self.documents:
+                        self.add(question_id, *fields)
+                if ids is not None:
+                    for question_id in set(self.documents) - ids:
+                        self.remove(question_id)
+                self.caught_up_at = started
+                # writes made during the read win over what it returned
+                self.replay(changes)
+
+    def replay(self, changes):
+        """applies writes recorded during a read, with the lock held"""
+        for action, question_id, fields in changes:
+            self.remove(question_id)
+            if action != 'delete':
+                self.add(question_id, *fields)
+
+    def load(self):
+        postings = {}
+        documents = {}
+        rows = db.session.query(*INDEXED_COLUMNS).order_by(
+            Question.id).yield_per(1000)
+        for question_id, text, category, difficulty in rows:
+            tokens = tuple(sys.intern(token) for token in tokenize(text))
+            documents[question_id] = (tokens, category, difficulty)
+            # rows arrive in id order, so appending keeps postings sorted
+            for token in set(tokens):
+                ids = postings.get(token)
+                if ids is None:
+                    ids = postings[token] = array('I')
+                ids.append(question_id)
+        return postings, documents, sorted(postings)
+
+    def load_since(self, last_id, indexed):
+        """the questions above last_id, and every id in the table when it
+        holds fewer rows than indexed plus those, or None"""
+        rows = db.session.query(*INDEXED_COLUMNS).filter(
+            Question.id > last_id).order_by(Question.id).all()
+        count = db.session.query(func.count(Question.id)).scalar()
+        if count >= indexed + len(rows):
+            return rows, None
+        return rows, {question_id for question_id,
+                      in db.session.query(Question.id)}
+
+    def refresh(self, app, task=None):
+        """runs task (a full build by default) in a background thread,
+        one refresh at a time"""
+        with self.lock:
+            if self.refreshing:
+                return
+            self.refreshing = True
+        threading.Thread(target=self.rebuild, args=(app, task or self.build),
+                         daemon=True).start()
+
+    def rebuild(self, app, task):
+        try:
+            with app.app_context():
+                task()
+        finally:
+            with self.lock:
+                self.refreshing = False
+
+    @contextmanager
+    def built(self):
+        """holds the lock on a built index, building it first if needed.
+        A bulk write may drop the postings while they are being built, so
+        they are checked again under the lock."""
+        while True:
+            self.lock.acquire()
+            if self.postings is not None:
+                break
+            self.lock.release()
+            self.build_if_missing()
+        if not fresh(self.built_at, self.ttl):
+            task = self.build
+        elif not fresh(self.caught_up_at, self.catch_up_ttl):
+            task = self.catch_up
+        else:
+            task = None
+        try:
+            yield
+        finally:
+            self.lock.release()
+        if task is not None:
+            self.refresh(current_app._get_current_object(), task)
+
+    def add(self, question_id, text, category, difficulty):
+        tokens = tuple(sys.intern(token) for token in tokenize(text))
+        self.documents[question_id] = (tokens, category, difficulty)
+        self.last_id = max(self.last_id, question_id)
+        for token in set(tokens):
+            ids = self.postings.get(token)
+            if ids is None:
+                ids = self.postings[token] = array('I')
+                insort(self.vocabulary, token)
+            position = bisect_left(ids, question_id)
+            if position == len(ids) or ids[position] != question_id:
+                ids.insert(position, question_id)
+
+    def remove(self, question_id):
+        tokens = self.documents.pop(question_id, ((),))[0]
+        for token in set(tokens):
+            ids = self.postings.get(token)
+            if ids is None:
+                continue
+            position = bisect_left(ids, question_id)
+            if position < len(ids) and ids[position] == question_id:
+                ids.pop(position)
+            if not ids:
+                del self.postings[token]
+                self.vocabulary.pop(bisect_left(self.vocabulary, token))
+
+    def on_change(self, action, question):
+        with self.lock:
+            fields = question and (question.question, question.category,
+                                   question.difficulty)
+            if self.changes is not None:
+                self.changes.append((action, question and question.id, fields))
+            if action == 'bulk':
+                # rebuilt from the table on next use
+                self.postings = None
+                return
+            if self.postings is None:
+                return
+            self.remove(question.id)
+            if action != 'delete':
+                self.add(question.id, *fields)
+
+    def search(self, terms, category=None, difficulty=None):
+        """ids containing every term, optionally of a category and
+        difficulty, best matches first"""
+        with self.built():
+            terms = set(terms)
+            if not terms:
+                return []
+            lists = sorted((self.postings.get(term, EMPTY) for term in terms),
+                           key=len)
+            # walk the rarest term and probe the others by binary search
+            matches = [question_id for question_id in lists[0]
+                       if all(contains(ids, question_id)
+                              for ids in lists[1:])]
+            if category is not None or difficulty is not None:
+                matches = [question_id for question_id in matches
+                           if matching(self.documents[question_id],
+                                       category, difficulty)]
+
+            return sorted(matches, key=lambda question_id: rank(
+                self.documents[question_id][0], terms, question_id))
+
+    def suggest(self, prefix, limit):
+        """the limit most used tokens starting with prefix, with counts"""
+        with self.built():
+            start = bisect_left(self.vocabulary, prefix)
+            end = bisect_left(self.vocabulary, prefix + '\U0010ffff', start)
+            words = self.vocabulary[start:end]
+            return [(word, len(self.postings[word])) for word in nlargest(
+                limit, words, key=lambda word: len(self.postings[word]))]
+
+
+EMPTY = array('I')
+
+INDEXED_COLUMNS = (Question.id, Question.question, Question.category,
+                   Question.difficulty)
+
+
+def matching(document, category, difficulty):
+    tokens, document_category, document_difficulty = document
+    return (category is None or
+            category_key(document_category) == category_key(category)) and \
+        (difficulty is None or document_difficulty == difficulty)
+
+
+def rank(tokens, terms, question_id):
+    """sort key putting questions made up more of the terms first"""
+    hits = sum(1 for token in tokens if token in terms)
+    return (-hits / len(tokens), question_id)
+
+
+def contains(ids, question_id):
+    position = bisect_left(ids, question_id)
+    return position < len(ids) and ids[position] == question_id
+
+
+question_index = app_local('question_index')
+question_listeners.append(app_listener('question_index', 'on_change'))
+
+"""
+search_questions(request, search, category=None, difficulty=None)
+    a page of questions matching a search term and the total number of
+    matches, optionally narrowed to a category and difficulty. With
+    SEARCH_BACKEND 'auto', Postgres ranks matches with ts_rank over the
+    full-text index and other databases use the in-process index; 'memory'
+    always uses the in-process index. Clients that just wrote are matched
+    against the table instead of the index, see replicas.py.
+"""
+
+
+def search_questions(request, search, category=None, difficulty=None,
+                     per_page=QUESTIONS_PER_PAGE):
+    if current_app.config.get('SEARCH_BACKEND') != 'memory' and \
+            db.session.get_bind().dialect.name == 'postgresql':
+        return search_fulltext(
+            request, search, category, difficulty, per_page)
+    return search_index(request, search, category, difficulty, per_page)
+
+
+def search_fulltext(request, search, category=None, difficulty=None,
+                    per_page=QUESTIONS_PER_PAGE):
+    document = func.to_tsvector(SEARCH_CONFIG, Question.question)
+    query = func.plainto_tsquery(SEARCH_CONFIG, search)
+    selection = filter_questions(
+        Question.query.filter(document.op('@@')(query)),
+        category, difficulty).order_by(
+        func.ts_rank(document, query).desc(), Question.id)
+
+    return paginate_questions(request, selection, per_page), \
+        count_rows(selection)
+
+
+def search_index(request, search, category=None, difficulty=None,
+                 per_page=QUESTIONS_PER_PAGE):
+    if reads_own_writes():
+        ids = search_table(tokenize(search), category, difficulty)
+    else:
+        ids = question_index.search(tokenize(search), category, difficulty)
+
+    page = request.args.get('page', 1, type=int)
+    if page < 1:
+        return [], len(ids)
+    start = (page - 1) * per_page
+    page_ids = ids[start:start + per_page]
+
+    return hydrate_questions(page_ids), len(ids)
+
+
+"""
+search_table(terms, category=None, difficulty=None)
+    the ids InvertedIndex.search would return, read from the questions
+    table: a LIKE per term narrows the rows and tokenizing them keeps
+    exact matches
+"""
+
+
+def search_table(terms, category=None, difficulty=None):
+    terms = set(terms)
+    if not terms:
+        return []
+    rows = filter_questions(
+        db.session.query(Question.id, Question.question),
+        category, difficulty).filter(
+        *(Question.question.ilike('%{}%'.format(term)) for term in terms))
+    matches = {}
+    for question_id, text in rows:
+        tokens = tokenize(text)
+        if terms.issubset(tokens):
+            matches[question_id] = tokens
+    return sorted(matches, key=lambda question_id: rank(
+        matches[question_id], terms, question_id))
+
+
+"""
+filter_questions(query, category=None, difficulty=None)
+    narrows a questions query to a category and/or difficulty in SQL
+"""
+
+
+def filter_questions(query, category=None, difficulty=None):
+    if category is not None:
+        query = query.filter(Question.category == category)
+    if difficulty is not None:
+        query = query.filter(Question.difficulty == difficulty)
+    return query
@@ -0,0 +1,195 @@
+import threading
+import time
+from collections import OrderedDict
+
+from .backends import MemoryBackend
+
+# seconds a quiz session survives without being used
+QUIZ_SESSION_TTL = 30 * 60
+
+# sessions kept in-process before the least recently used is dropped
+QUIZ_SESSION_LIMIT = 10000
+
+# bytes of decks kept in-process before the least recently used is dropped
+QUIZ_SESSION_BYTES = 64 * 1024 * 1024
+
+# bytes of shared session decks a worker keeps after reading them
+DECK_CACHE_BYTES = 64 * 1024 * 1024
+
+"""
+QuizSession
+    a quiz's shuffled deck of question ids and how far it has been dealt.
+    Concurrent requests for one session each get their own questions.
+"""
+
+
+class QuizSession:
+
+    def __init__(self, deck):
+        self.deck = deck
+        self.position = 0
+        self.lock = threading.Lock()
+
+    def remaining(self):
+        return len(self.deck) - self.position
+
+    def deal(self):
+        with self.lock:
+            if self.position >= len(self.deck):
+                return None
+            question_id = self.deck[self.position]
+            self.position += 1
+            return question_id
+
+    def deal_many(self, count):
+        with self.lock:
+            dealt = self.deck[self.position:self.position + count]
+            self.position += len(dealt)
+            return list(dealt)
+
+
+"""
+MemorySessionStore
+    bounded in-process session store. Entries expire ttl seconds after they
+    were last used and the least recently used entry is dropped once limit
+    sessions or max_bytes of decks are stored, whichever comes first; a
+    session alone bigger than max_bytes isn't kept. Any object with the
+    same get/set/delete methods can be passed as QUIZ_SESSION_STORE
+    instead, e.g. one backed by a shared cache.
+"""
+
+
+class MemorySessionStore:
+
+    def __init__(self, limit=QUIZ_SESSION_LIMIT, ttl=QUIZ_SESSION_TTL,
+                 max_bytes=QUIZ_SESSION_BYTES):
+        self.limit = limit
+        self.ttl = ttl
+        self.max_bytes = max_bytes
+        self.lock = threading.Lock()
+        self.entries = OrderedDict()
+        self.size = 0
+
+    def get(self, key):
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is None:
+                return None
+            value, expires, size = entry
+            if expires < time.monotonic():
+                self.drop(key)
+                return None
+            self.entries[key] = (value, time.monotonic() + self.ttl, size)
+            self.entries.move_to_end(key)
+            return value
+
+    def set(self, key, value):
+        size = session_bytes(value)
+        if size > self.max_bytes:
+            return
+        with self.lock:
+            if key in self.entries:
+                self.drop(key)
+            self.entries[key] = (value, time.monotonic() + self.ttl, size)
+            self.size += size
+            while len(self.entries) > self.limit or \
+                    self.size > self.max_bytes:
+                self.drop(next(iter(self.entries)))
+
+    def drop(self, key):
+        """removes an entry, with the lock held"""
+        value, expires, size = self.entries.pop(key)
+        self.size -= size
+
+    def delete(self, key):
+        with self.lock:
+            if key in self.entries:
+                self.drop(key)
+
+
+def session_bytes(session):
+    deck = session.deck
+    return len(deck) * getattr(deck, 'itemsize', 8)
+
+
+"""
+BackendSessionStore
+    session store on a cache backend (see backends.py), so every worker
+    sharing the backend sees the same sessions. A deck is written once, as
+    raw ids, and cached by each worker that reads it; how far it has been
+    dealt is a counter advanced with incr, so a deal costs the same for any
+    deck size and two workers never deal the same question. Every deal
+    renews the TTL.
+"""
+
+
+class BackendSessionStore:
+
+    def __init__(self, backend, ttl=QUIZ_SESSION_TTL,
+                 deck_cache_bytes=DECK_CACHE_BYTES):
+        self.backend = backend
+        self.ttl = ttl
+        self.decks = MemoryBackend(deck_cache_bytes)
+
+    def key(self, session_id, part):
+        return 'quiz-sessions:{}:{}'.format(session_id, part)
+
+    def get(self, key):
+        deck_key = self.key(key, 'deck')
+        deck = self.decks.get(deck_key)
+        if deck is None:
+            deck = self.backend.get(deck_key)
+            if deck is None:
+                return None
+            self.decks.set(deck_key, deck, self.ttl)
+        return SharedQuizSession(self, key, memoryview(deck).cast('I'))
+
+    def set(self, key, session):
+        deck = session.deck[session.position:].tobytes()
+        self.backend.set(self.key(key, 'deck'), deck, self.ttl)
+        self.decks.set(self.key(key, 'deck'), deck, self.ttl)
+
+    def delete(self, key):
+        self.backend.delete(self.key(key, 'deck'))
+        self.backend.delete(self.key(key, 'position'))
+        self.decks.delete(self.key(key, 'deck'))
+
+    def advance(self, key, count):
+        """the dealt position after claiming the next count questions"""
+        position = self.backend.incr(
+            self.key(key, 'position'), count, self.ttl)
+        self.backend.touch(self.key(key, 'deck'), self.ttl)
+        return position
+
+    def position(self, key):
+        position = self.backend.get(self.key(key, 'position'))
+        return int(position) if position is not None else 0
+
+
+"""
+SharedQuizSession
+    a session of a BackendSessionStore, dealing from the shared position
+"""
+
+
+class SharedQuizSession:
+
+    def __init__(self, store, session_id, deck):
+        self.store = store
+        self.session_id = session_id
+        self.deck = deck
+        self.position = None
+
+    def remaining(self):
+        if self.position is None:
+            self.position = self.store.position(self.session_id)
+        return max(len(self.deck) - self.position, 0)
+
+    def deal(self):
+        dealt = self.deal_many(1)
+        return dealt[0] if dealt else None
+
+    def deal_many(self, count):
+        self.position = self.store.advance(self.session_id, count)
+        start = min(self.position - count, len(self.deck))
+        return list(self.deck[start:min(self.position, len(self.deck))])
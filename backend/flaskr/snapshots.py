@@ -0,0 +1,28 @@
+import time
+
+"""
+Process snapshots
+    question counts, quiz pools, the category map and the search index are
+    read from the database once and then kept in the process. Each worker
+    applies its own writes to its snapshots at once, but only sees writes
+    made by other workers (or by hand in psql) when a snapshot is re-read,
+    so every snapshot is trusted for at most SNAPSHOT_TTL seconds.
+
+    Writes touching many rows, or possibly moving a question out of a
+    category it can no longer be found in, don't patch snapshots but drop
+    them; they are re-read on next use.
+"""
+
+SNAPSHOT_TTL = 60
+
+# question write actions that drop snapshots instead of patching them
+DROPPING_ACTIONS = ('update', 'bulk')
+
+
+def fresh(loaded_at, ttl=SNAPSHOT_TTL):
+    """whether a snapshot loaded at loaded_at (time.monotonic()) is usable"""
+    return loaded_at is not None and time.monotonic() - loaded_at < ttl
+
+
+def drops_snapshots(action):
+    return action in DROPPING_ACTIONS
@@ -0,0 +1,145 @@
+import importlib
+import pkgutil
+
+from sqlalchemy import text
+
+from . import versions
+
+# single-row table recording the revision a database is at
+VERSION_TABLE = 'schema_version'
+
+"""
+Migrations
+    schema changes shipped with the app, one module per revision in
+    migrations/versions. Each module defines `revision`, `down_revision`
+    (None for the first) and upgrade(connection) / downgrade(connection).
+    Every revision runs in its own transaction together with the update of
+    the version row. Revisions only create what is missing, so they can be
+    applied to databases created from trivia.psql or by db.create_all().
+"""
+
+
+class MigrationError(Exception):
+    pass
+
+
+"""
+load_migrations()
+    the version modules, ordered from the first revision to the head
+"""
+
+
+def load_migrations():
+    modules = [importlib.import_module('{}.{}'.format(versions.__name__, name))
+               for _, name, _ in pkgutil.iter_modules(versions.__path__)]
+    by_parent = {module.down_revision: module for module in modules}
+
+    chain = []
+    revision = None
+    while revision in by_parent:
+        module = by_parent[revision]
+        chain.append(module)
+        revision = module.revision
+    if len(chain) != len(modules):
+        raise MigrationError('migration history is not a single chain')
+    return chain
+
+
+def head():
+    migrations = load_migrations()
+    return migrations[-1].revision if migrations else None
+
+
+def current_revision(connection):
+    if not connection.dialect.has_table(connection, VERSION_TABLE):
+        return None
+    return connection.execute(
+        text('SELECT revision FROM {}'.format(VERSION_TABLE))).scalar()
+
+
+def set_revision(connection, revision):
+    connection.execute(text(
+        'CREATE TABLE IF NOT EXISTS {} (revision VARCHAR(32) NOT NULL)'.format(
+            VERSION_TABLE)))
+    connection.execute(text('DELETE FROM {}'.format(VERSION_TABLE)))
+    if revision is not None:
+        connection.execute(text(
+            'INSERT INTO {} (revision) VALUES (:revision)'.format(
+                VERSION_TABLE)), revision=revision)
+
+
+def position(migrations, revision):
+    """index of revision in migrations, -1 for an empty database"""
+    if revision is None:
+        return -1
+    for index, module in enumerate(migrations):
+        if module.revision == revision:
+            return index
+    raise MigrationError('unknown revision {}'.format(revision))
+
+
+"""
+pending(connection)
+    the revisions the database hasn't applied yet. A revision this app
+    doesn't know is taken to come from a newer release, so nothing is
+    pending. One read of the version row, cheap enough for startup.
+"""
+
+
+def pending(connection):
+    migrations = load_migrations()
+    try:
+        start = position(migrations, current_revision(connection))
+    except MigrationError:
+        return []
+    return [module.revision for module in migrations[start + 1:]]
+
+
+"""
+upgrade(engine, target=None)
+    applies every revision after the database's current one up to target
+    (the head by default). Returns the revisions applied.
+"""
+
+
+def upgrade(engine, target=None):
+    migrations = load_migrations()
+    with engine.connect() as connection:
+        start = position(migrations, current_revision(connection))
+    end = position(migrations, target or migrations[-1].revision)
+    if end < start:
+        raise MigrationError('{} is older than the current revision'.format(
+            target))
+
+    applied = []
+    for module in migrations[start + 1:end + 1]:
+        with engine.begin() as connection:
+            module.upgrade(connection)
+            set_revision(connection, module.revision)
+        applied.append(module.revision)
+    return applied
+
+
+"""
+downgrade(engine, target=None)
+    reverts revisions newest first until the database is at target (one
+    revision back by default). Returns the revisions reverted.
+"""
+
+
+def downgrade(engine, target=None):
+    migrations = load_migrations()
+    with engine.connect() as connection:
+        start = position(migrations, current_revision(connection))
+    end = position(migrations, target) if target else start - 1
+    if end > start:
+        raise MigrationError('{} is newer than the current revision'.format(
+            target))
+
+    reverted = []
+    for module in reversed(migrations[end + 1:start + 1]):
+        with engine.begin() as connection:
+            module.downgrade(connection)
+            set_revision(connection, module.down_revision)
+        reverted.append(module.revision)
+    return reverted
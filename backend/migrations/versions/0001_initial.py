@@ -0,0 +1,38 @@
+"""
+0001 initial
+    the categories and questions tables as shipped in trivia.psql. It
+    can't be reverted: the tables may predate the migrations and hold the
+    only copy of the data.
+"""
+
+from sqlalchemy import Column, Integer, MetaData, String, Table
+
+from .. import MigrationError
+
+revision = '0001'
+down_revision = None
+
+metadata = MetaData()
+
+categories = Table(
+    'categories', metadata,
+    Column('id', Integer, primary_key=True),
+    Column('type', String))
+
+questions = Table(
+    'questions', metadata,
+    Column('id', Integer, primary_key=True),
+    Column('question', String),
+    Column('answer', String),
+    Column('difficulty', Integer),
+    Column('category', Integer))
+
+
+def upgrade(connection):
+    metadata.create_all(connection, checkfirst=True)
+
+
+def downgrade(connection):
+    raise MigrationError(
+        'refusing to drop the categories and questions tables, '
+        'drop them by hand to start over')
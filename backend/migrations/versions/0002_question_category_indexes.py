@@ -0,0 +1,53 @@
+"""
+0002 question category indexes
+    makes questions.category an integer referencing categories (databases
+    created from the old model have it as a string), and indexes it for
+    the per-category listings, counts and quizzes. Questions pointing at a
+    category that doesn't exist are moved to no category, as the foreign
+    key's ON DELETE SET NULL would have done. Reverting it only drops the
+    indexes: the integer column, the foreign key and the moved questions
+    stay as they are.
+"""
+
+from sqlalchemy import Integer, inspect, text
+
+revision = '0002'
+down_revision = '0001'
+
+INDEXES = {
+    'ix_questions_category_id': '(category, id)',
+    'ix_questions_category_difficulty': '(category, difficulty)'
+}
+
+
+def upgrade(connection):
+    inspector = inspect(connection)
+    postgres = connection.dialect.name == 'postgresql'
+
+    if postgres:
+        column = next(column for column in inspector.get_columns('questions')
+                      if column['name'] == 'category')
+        if not isinstance(column['type'], Integer):
+            connection.execute(text(
+                "ALTER TABLE questions ALTER COLUMN category TYPE integer "
+                "USING NULLIF(category, '')::integer"))
+
+        if not any(key['referred_table'] == 'categories'
+                   for key in inspector.get_foreign_keys('questions')):
+            connection.execute(text(
+                'UPDATE questions SET category = NULL WHERE category NOT IN '
+                '(SELECT id FROM categories)'))
+            connection.execute(text(
+                'ALTER TABLE questions ADD CONSTRAINT category '
+                'FOREIGN KEY (category) REFERENCES categories (id) '
+                'ON UPDATE CASCADE ON DELETE SET NULL'))
+
+    for name, columns in INDEXES.items():
+        connection.execute(text(
+            'CREATE INDEX IF NOT EXISTS {} ON questions {}'.format(
+                name, columns)))
+
+
+def downgrade(connection):
+    for name in INDEXES:
+        connection.execute(text('DROP INDEX IF EXISTS {}'.format(name)))
@@ -0,0 +1,23 @@
+"""
+0003 question search index
+    GIN index over the question text used by full-text search on Postgres
+"""
+
+from sqlalchemy import text
+
+revision = '0003'
+down_revision = '0002'
+
+
+def upgrade(connection):
+    if connection.dialect.name != 'postgresql':
+        return
+    connection.execute(text(
+        "CREATE INDEX IF NOT EXISTS questions_question_fts ON questions "
+        "USING GIN (to_tsvector('english', question))"))
+
+
+def downgrade(connection):
+    if connection.dialect.name != 'postgresql':
+        return
+    connection.execute(text('DROP INDEX IF EXISTS questions_question_fts'))
@@ -1,7 +1,14 @@
 import os
-from sqlalchemy import Column, String, Integer, create_engine
-from flask_sqlalchemy import SQLAlchemy
+import threading
+import time
+from sqlalchemy import (Column, String, Integer, ForeignKey, Index,
+                        create_engine)
+from sqlalchemy.engine.url import make_url
+from sqlalchemy.exc import TimeoutError
+from sqlalchemy.pool import QueuePool
 import json
+
+from routing import RoutingSQLAlchemy, replica_router
 DB_USER = os.environ.get('DB_USER')
 DB_PASSWORD = os.environ.get('DB_PASSWORD')
 
@@ -11,113 +18,226 @@ database_path = 'postgresql://{}:{}@{}/{}'.format(
     DB_USER, DB_PASSWORD, 'localhost:5432', database_name)
 
 
-db = SQLAlchemy()
+db = RoutingSQLAlchemy()
 
 """
-setup_db(app)
-    binds a flask application and a SQLAlchemy service
+setup_db(app, database_path, config, replica_paths, replica_strategy)
+    binds a flask application and a SQLAlchemy service. config is a
+    DatabaseConfig (or a dict of its arguments) and defaults to the app's
+    DATABASE setting. Read-only requests may be routed to the replicas
+    (see routing.py). The schema isn't touched; it is managed with
+    `flask db upgrade` (see migrations).
 """
 
 
-def setup_db(app, database_path=database_path):
+def setup_db(app, database_path=database_path, config=None,
+             replica_paths=(), replica_strategy='round_robin'):
+    config = config or app.config.get('DATABASE') or DatabaseConfig()
+    if isinstance(config, dict):
+        config = DatabaseConfig(**config)
     app.config["SQLALCHEMY_DATABASE_URI"] = database_path
     app.config["SQLALCHEMY_TRACK_MODIFICATIONS"] = False
+    app.config["SQLALCHEMY_ENGINE_OPTIONS"] = config.engine_options(
+        database_path)
     db.app = app
     db.init_app(app)
-    db.create_all()
+    if replica_paths:
+        app.extensions['replica_router'] = replica_router(
+            replica_paths, config, replica_strategy)
+
 
+EXECUTEMANY_MODES = ('default', 'batch')
 
 """
-Question
+DatabaseConfig
+    connection pool and engine settings. Anything left as None keeps
+    SQLAlchemy's default. statement_timeout is in milliseconds and
+    executemany_mode 'batch' sends executemany() through psycopg2's
+    execute_batch; both only apply to Postgres.
 """
 
 
-class Question(db.Model):
-    __tablename__ = 'questions'
+class DatabaseConfig:
+
+    def __init__(self, pool_size=None, max_overflow=None, pool_timeout=None,
+                 pool_pre_ping=False, pool_recycle=None,
+                 statement_timeout=None, executemany_mode='default'):
+        if executemany_mode not in EXECUTEMANY_MODES:
+            raise ValueError('executemany_mode must be one of {}'.format(
+                ', '.join(EXECUTEMANY_MODES)))
+        self.pool_size = pool_size
+        self.max_overflow = max_overflow
+        self.pool_timeout = pool_timeout
+        self.pool_pre_ping = pool_pre_ping
+        self.pool_recycle = pool_recycle
+        self.statement_timeout = statement_timeout
+        self.executemany_mode = executemany_mode
+
+    @classmethod
+    def from_env(cls, environ=os.environ):
+        """settings from DB_POOL_SIZE, DB_MAX_OVERFLOW, DB_POOL_TIMEOUT,
+        DB_POOL_PRE_PING, DB_POOL_RECYCLE, DB_STATEMENT_TIMEOUT and
+        DB_EXECUTEMANY_MODE"""
+        def number(name, type=int):
+            value = environ.get(name)
+            return type(value) if value else None
+
+        return cls(
+            pool_size=number('DB_POOL_SIZE'),
+            max_overflow=number('DB_MAX_OVERFLOW'),
+            pool_timeout=number('DB_POOL_TIMEOUT', float),
+            pool_pre_ping=environ.get('DB_POOL_PRE_PING', '0') != '0',
+            pool_recycle=number('DB_POOL_RECYCLE'),
+            statement_timeout=number('DB_STATEMENT_TIMEOUT'),
+            executemany_mode=environ.get('DB_EXECUTEMANY_MODE', 'default'))
+
+    def engine_options(self, database_path):
+        backend = make_url(database_path).get_backend_name()
+        options = {}
+        # SQLite files get no pool unless one is sized explicitly
+        if backend != 'sqlite' or self.pool_size:
+            options['poolclass'] = TimedQueuePool
+            for name in ('pool_size', 'max_overflow', 'pool_timeout'):
+                if getattr(self, name) is not None:
+                    options[name] = getattr(self, name)
+        if self.pool_recycle is not None:
+            options['pool_recycle'] = self.pool_recycle
+        if self.pool_pre_ping:
+            options['pool_pre_ping'] = True
+        if backend == 'postgresql':
+            if self.statement_timeout is not None:
+                options['connect_args'] = {
+                    'options': '-c statement_timeout={}'.format(
+                        int(self.statement_timeout))}
+            if self.executemany_mode == 'batch':
+                options['use_batch_mode'] = True
+        return options
 
-    id = Column(Integer, primary_key=True)
-    question = Column(String)
-    answer = Column(String)
-    category = Column(Integer)
-    difficulty = Column(Integer)
-
-    def __init__(self, question, answer, category, difficulty):
-        self.question = question
-        self.answer = answer
-        self.category = category
-        self.difficulty = difficulty
-
-    def insert(self):
-        db.session.add(self)
-        db.session.commit()
 
-    def update(self):
-        db.session.commit()
+"""
+TimedQueuePool
+    QueuePool that also counts checkouts and how long they waited for a
+    free connection, and how many gave up after pool_timeout
+"""
 
-    def delete(self):
-        db.session.delete(self)
-        db.session.commit()
 
-    def format(self):
-        return {
-            'id': self.id,
-            'question': self.question,
-            'answer': self.answer,
-            'category': self.category,
-            'difficulty': self.difficulty
-        }
+class TimedQueuePool(QueuePool):
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.wait_lock = threading.Lock()
+        self.checkouts = 0
+        self.waits = 0
+        self.timeouts = 0
+        self.wait_time = 0.0
+        self.max_wait = 0.0
+
+    def _do_get(self):
+        # only a checkout finding every connection in use waits for one;
+        # the others take an idle connection or open a new one
+        blocking = self.exhausted()
+        start = time.monotonic()
+        timed_out = False
+        try:
+            return super()._do_get()
+        except TimeoutError:
+            timed_out = True
+            raise
+        finally:
+            waited = time.monotonic() - start
+            with self.wait_lock:
+                self.checkouts += 1
+                if timed_out:
+                    self.timeouts += 1
+                if blocking:
+                    self.waits += 1
+                    self.wait_time += waited
+                    self.max_wait = max(self.max_wait, waited)
+
+    def exhausted(self):
+        return self._max_overflow > -1 and \
+            self.checkedout() >= self.size() + self._max_overflow
+
+    def stats(self):
+        with self.wait_lock:
+            return {
+                'pool_size': self.size(),
+                'checked_out': self.checkedout(),
+                'checked_in': self.checkedin(),
+                'overflow': max(self.overflow(), 0),
+                'checkouts': self.checkouts,
+                'waits': self.waits,
+                'timeouts': self.timeouts,
+                'wait_ms': round(self.wait_time * 1000, 3),
+                'max_wait_ms': round(self.max_wait * 1000, 3)
+            }
 
 
 """
-Category
+pool_stats()
+    the connection pool counters of this worker's engine, and how reads
+    are spread over its replicas when it has any
 """
 
 
-class Category(db.Model):
-    __tablename__ = 'categories'
+def pool_stats():
+    pool = db.engine.pool
+    stats = {'pool': type(pool).__name__}
+    if isinstance(pool, TimedQueuePool):
+        stats.update(pool.stats())
+    router = db.get_app().extensions.get('replica_router')
+    if router is not None:
+        stats['read_replicas'] = router.stats()
+    return stats
 
-    id = Column(Integer, primary_key=True)
-    type = Column(String)
 
-    def __init__(self, type):
-        self.type = type
+"""
+question_listeners
+    callables notified with (action, question) once a question write is
+    committed; action is one of 'insert', 'update' or 'delete', or 'bulk'
+    with no question after a write touching many rows at once
+"""
+
+question_listeners = []
 
-    def format(self):
-        return {
-            'id': self.id,
-            'type': self.type
-        }
 
+def notify_question_listeners(action, question):
+    for listener in question_listeners:
+        listener(action, question)
 
-db = SQLAlchemy()
 
 """
-setup_db(app)
-    binds a flask application and a SQLAlchemy service
+category_listeners
+    callables notified with (action, category) once a category write is
+    committed
 """
 
+category_listeners = []
 
-def setup_db(app, database_path=database_path):
-    app.config["SQLALCHEMY_DATABASE_URI"] = database_path
-    app.config["SQLALCHEMY_TRACK_MODIFICATIONS"] = False
-    db.app = app
-    db.init_app(app)
-    db.create_all()
+
+def notify_category_listeners(action, category):
+    for listener in category_listeners:
+        listener(action, category)
 
 
 """
 Question
-
 """
 
 
 class Question(db.Model):
     __tablename__ = 'questions'
+    __table_args__ = (
+        Index('ix_questions_category_id', 'category', 'id'),
+        Index('ix_questions_category_difficulty', 'category', 'difficulty'),
+    )
 
     id = Column(Integer, primary_key=True)
     question = Column(String)
     answer = Column(String)
-    category = Column(String)
+    category = Column(Integer, ForeignKey(
+        'categories.id', name='category',
+        onupdate='CASCADE', ondelete='SET NULL'))
     difficulty = Column(Integer)
 
     def __init__(self, question, answer, category, difficulty):
@@ -129,13 +249,16 @@ class Question(db.Model):
     def insert(self):
         db.session.add(self)
         db.session.commit()
+        notify_question_listeners('insert', self)
 
     def update(self):
         db.session.commit()
+        notify_question_listeners('update', self)
 
     def delete(self):
         db.session.delete(self)
         db.session.commit()
+        notify_question_listeners('delete', self)
 
     def format(self):
         return {
@@ -149,7 +272,6 @@ class Question(db.Model):
 
 """
 Category
-
 """
 
 
@@ -162,6 +284,20 @@ class Category(db.Model):
     def __init__(self, type):
         self.type = type
 
+    def insert(self):
+        db.session.add(self)
+        db.session.commit()
+        notify_category_listeners('insert', self)
+
+    def update(self):
+        db.session.commit()
+        notify_category_listeners('update', self)
+
+    def delete(self):
+        db.session.delete(self)
+        db.session.commit()
+        notify_category_listeners('delete', self)
+
     def format(self):
         return {
             'id': self.id,
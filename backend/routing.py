@@ -0,0 +1,162 @@
+import itertools
+import threading
+import time
+
+from flask import g, has_request_context
+from flask_sqlalchemy import SQLAlchemy, SignallingSession
+from sqlalchemy import create_engine, event, orm
+from sqlalchemy.exc import DBAPIError
+
+# seconds a replica that failed is left out of rotation
+REPLICA_RETRY = 30
+
+REPLICA_STRATEGIES = ('round_robin', 'least_connections')
+
+"""
+Replica
+    a read replica's engine, with the connections it has checked out and
+    whether it is currently left out after a failure. A replica is marked
+    down when connecting to it or a connection to it fails, and is only
+    probed with a fresh connection before it is first used and once its
+    retry time has passed.
+"""
+
+
+class Replica:
+
+    def __init__(self, engine):
+        self.engine = engine
+        self.lock = threading.Lock()
+        self.in_use = 0
+        self.down_until = 0
+        self.verified = False
+        event.listen(engine, 'checkout', self.on_checkout)
+        event.listen(engine, 'checkin', self.on_checkin)
+        event.listen(engine, 'handle_error', self.on_error)
+
+    def on_checkout(self, dbapi_connection, record, proxy):
+        with self.lock:
+            self.in_use += 1
+
+    def on_checkin(self, dbapi_connection, record):
+        with self.lock:
+            self.in_use -= 1
+
+    def on_error(self, context):
+        # errors in the statement itself say nothing about the replica
+        if context.is_disconnect or context.connection is None:
+            self.mark_down()
+
+    def mark_down(self):
+        self.verified = False
+        self.down_until = time.monotonic() + REPLICA_RETRY
+
+    def available(self):
+        return self.down_until <= time.monotonic()
+
+    def usable(self):
+        """whether the replica can take a request, probing it if unverified"""
+        return self.verified or self.probe()
+
+    def probe(self):
+        """checks out a connection, marking the replica down if it fails"""
+        try:
+            self.engine.connect().close()
+        except DBAPIError:
+            self.mark_down()
+            return False
+        self.verified = True
+        return True
+
+    def stats(self):
+        return {
+            'url': repr(self.engine.url),
+            'in_use': self.in_use,
+            'available': self.available()
+        }
+
+
+"""
+ReplicaRouter
+    picks the replica engine a read-only request runs on, round robin or
+    the one with the fewest checked out connections. Replicas that are down
+    are skipped; with none left, None sends the request to the primary.
+"""
+
+
+class ReplicaRouter:
+
+    def __init__(self, engines, strategy='round_robin'):
+        if strategy not in REPLICA_STRATEGIES:
+            raise ValueError('strategy must be one of {}'.format(
+                ', '.join(REPLICA_STRATEGIES)))
+        self.strategy = strategy
+        self.replicas = [Replica(engine) for engine in engines]
+        self.turns = itertools.count()
+        self.fallbacks = 0
+
+    def candidates(self):
+        available = [replica for replica in self.replicas
+                     if replica.available()]
+        if not available:
+            return []
+        start = next(self.turns) % len(available)
+        candidates = available[start:] + available[:start]
+        if self.strategy == 'least_connections':
+            # stable, so replicas equally busy still take turns
+            candidates.sort(key=lambda replica: replica.in_use)
+        return candidates
+
+    def choose(self):
+        for replica in self.candidates():
+            if replica.usable():
+                return replica.engine
+        self.fallbacks += 1
+        return None
+
+    def stats(self):
+        return {
+            'strategy': self.strategy,
+            'fallbacks': self.fallbacks,
+            'replicas': [replica.stats() for replica in self.replicas]
+        }
+
+
+"""
+replica_router(urls, config, strategy)
+    a router over engines for the replica urls, pooled like the primary
+    according to config (a DatabaseConfig)
+"""
+
+
+def replica_router(urls, config, strategy='round_robin'):
+    return ReplicaRouter(
+        [create_engine(url, **config.engine_options(url)) for url in urls],
+        strategy)
+
+
+"""
+RoutingSession
+    session that runs requests flagged g.read_replica on a replica picked
+    once per request, and everything else, including any flush, on the
+    primary. Without replicas the flag changes nothing.
+"""
+
+
+class RoutingSession(SignallingSession):
+
+    def get_bind(self, mapper=None, clause=None):
+        if not self._flushing and has_request_context() and \
+                g.get('read_replica'):
+            if 'replica_engine' not in g:
+                router = self.app.extensions.get('replica_router')
+                g.replica_engine = router.choose() if router else None
+            if g.replica_engine is not None:
+                return g.replica_engine
+        return super().get_bind(mapper, clause)
+
+
+class RoutingSQLAlchemy(SQLAlchemy):
+
+    def create_session(self, options):
+        return orm.sessionmaker(class_=RoutingSession, db=self, **options)
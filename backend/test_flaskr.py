@@ -1,10 +1,33 @@
 import os
 import unittest
 import json
-from flask_sqlalchemy import SQLAlchemy
+import tempfile
+import socketserver
+import sqlite3
+import threading
+import time
+from array import array
+from collections import defaultdict
+from flask import Flask
+from sqlalchemy import create_engine, event, inspect
+from sqlalchemy.exc import OperationalError, TimeoutError
 
 from flaskr import create_app
-from models import setup_db, Question, Category
+from flaskr.pagination import QUESTIONS_PER_PAGE
+import migrations
+from routing import ReplicaRouter
+from models import (db, setup_db, Question, Category, DatabaseConfig,
+                    TimedQueuePool)
+from flaskr.backends import (MemoryBackend, SQLiteBackend, RedisBackend,
+                             RespClient, NamespacedCache)
+from flaskr.singleflight import SingleFlight
+from flaskr.sessions import (QuizSession, MemorySessionStore,
+                             BackendSessionStore)
+from flaskr.search import InvertedIndex
+from flaskr.counts import QuestionCounts
+from flaskr.quiz import QuestionPools
+from flaskr.conditional import TableVersions
+from flaskr.cache import ResponseCache, cached
 DB_USER = os.environ.get('DB_USER')
 DB_PASSWORD = os.environ.get('DB_PASSWORD')
 
@@ -12,22 +35,26 @@ DB_PASSWORD = os.environ.get('DB_PASSWORD')
 class TriviaTestCase(unittest.TestCase):
     """This class represents the trivia test case"""
 
+    database_name = 'trivia_test'
+    database_path = 'postgresql://{}:{}@{}/{}'.format(
+        DB_USER, DB_PASSWORD, 'localhost:5432', database_name)
+
+    @classmethod
+    def setUpClass(cls):
+        """Bring the test database schema up to date once per run."""
+        app = create_app()
+        setup_db(app, cls.database_path)
+        with app.app_context():
+            migrations.upgrade(db.engine)
+
     def setUp(self):
         """Define test variables and initialize app."""
         self.app = create_app()
         self.client = self.app.test_client
-        self.database_name = 'trivia_test'
-        self.database_path = 'postgresql://{}:{}@{}/{}'.format(
-            DB_USER, DB_PASSWORD, 'localhost:5432', self.database_name)
         setup_db(self.app, self.database_path)
 
         # binds the app to the current context
         with self.app.app_context():
-            self.db = SQLAlchemy()
-            self.db.init_app(self.app)
-            # create all tables
-            self.db.create_all()
-
             self.new_question = {
                 'question': 'What is the capital city of Nigeria',
                 'answer': 'Abuja',
@@ -45,6 +72,22 @@ class TriviaTestCase(unittest.TestCase):
     """
     # categories
 
+    def test_get_categories(self):
+        res = self.client().get('/categories')
+        data = json.loads(res.data)
+
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(data['success'], True)
+        self.assertEqual(data['categories']['5'], 'Entertainment')
+
+    def test_304_categories_not_modified(self):
+        etag = self.client().get('/categories').headers['ETag']
+        res = self.client().get('/categories',
+                                headers={'If-None-Match': etag})
+
+        self.assertEqual(res.status_code, 304)
+        self.assertEqual(res.data, b'')
+
     def test_fetch_questions_at_category(self):
         res = self.client().get('/categories/5/questions')
         data = json.loads(res.data)
@@ -81,6 +124,113 @@ class TriviaTestCase(unittest.TestCase):
         self.assertEqual(data['success'], False)
         self.assertEqual(data['message'], 'page not found')
 
+    def test_paginated_questions_total_is_independent_of_page(self):
+        first = json.loads(self.client().get('/questions?page=1').data)
+        second = json.loads(self.client().get('/questions?page=2').data)
+
+        self.assertEqual(first['total_questions'], second['total_questions'])
+        self.assertEqual(len(first['questions']), QUESTIONS_PER_PAGE)
+        self.assertTrue(len(second['questions']) <= QUESTIONS_PER_PAGE)
+        self.assertTrue(first['questions'][-1]['id'] <
+                        second['questions'][0]['id'])
+
+    def test_304_questions_not_modified(self):
+        etag = self.client().get('/questions?page=1').headers['ETag']
+        res = self.client().get('/questions?page=1',
+                                headers={'If-None-Match': etag})
+
+        self.assertEqual(res.status_code, 304)
+
+    def test_questions_etag_changes_after_create(self):
+        etag = self.client().get('/questions?page=1').headers['ETag']
+        self.client().post('/questions', json=self.new_question)
+        res = self.client().get('/questions?page=1',
+                                headers={'If-None-Match': etag})
+
+        self.assertEqual(res.status_code, 200)
+        self.assertNotEqual(res.headers['ETag'], etag)
+
+    def test_repeated_questions_page_is_served_from_cache(self):
+        self.client().get('/questions?page=1')
+        before = json.loads(self.client().get('/cache/stats').data)
+        self.client().get('/questions?page=1')
+        after = json.loads(self.client().get('/cache/stats').data)
+
+        self.assertEqual(after['response_cache']['hits'],
+                         before['response_cache']['hits'] + 1)
+
+    def test_get_pool_stats(self):
+        self.client().get('/questions')
+        res = self.client().get('/pool/stats')
+        data = json.loads(res.data)
+
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(data['database_pool']['pool'], 'TimedQueuePool')
+        self.assertTrue(data['database_pool']['checkouts'])
+
+    def test_pool_counts_only_checkouts_that_wait(self):
+        pool = TimedQueuePool(lambda: sqlite3.connect(':memory:'),
+                              pool_size=1, max_overflow=0, timeout=0.1)
+        connection = pool.connect()
+        with self.assertRaises(TimeoutError):
+            pool.connect()
+        connection.close()
+        pool.connect().close()
+
+        stats = pool.stats()
+        self.assertEqual(stats['checkouts'], 3)
+        self.assertEqual(stats['waits'], 1)
+        self.assertEqual(stats['timeouts'], 1)
+        self.assertTrue(stats['max_wait_ms'] >= 100)
+
+    def test_database_config_engine_options(self):
+        options = DatabaseConfig(
+            pool_size=5, pool_pre_ping=True, statement_timeout=2000,
+            executemany_mode='batch').engine_options(self.database_path)
+
+        self.assertEqual(options['pool_size'], 5)
+        self.assertTrue(options['pool_pre_ping'])
+        self.assertEqual(options['connect_args'],
+                         {'options': '-c statement_timeout=2000'})
+        self.assertTrue(options['use_batch_mode'])
+
+    def test_fetch_questions_by_cursor(self):
+        first = json.loads(self.client().get('/questions').data)
+        res = self.client().get(
+            '/questions?cursor={}'.format(first['next_cursor']))
+        data = json.loads(res.data)
+
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(data['success'], True)
+        self.assertTrue(data['questions'][0]['id'] >
+                        first['questions'][-1]['id'])
+
+    def test_fetch_questions_with_exact_total(self):
+        res = self.client().get('/questions?exact=true')
+        data = json.loads(res.data)
+
+        with self.app.app_context():
+            total = Question.query.count()
+
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(data['total_questions'], total)
+
+    def test_400_fetch_questions_with_bad_cursor(self):
+        res = self.client().get('/questions?cursor=not-a-cursor')
+        data = json.loads(res.data)
+
+        self.assertEqual(res.status_code, 400)
+        self.assertEqual(data['success'], False)
+        self.assertEqual(data['message'], 'Bad request')
+
+    def test_400_fetch_category_questions_with_bad_cursor(self):
+        res = self.client().get('/categories/1/questions?cursor=zzz!')
+        data = json.loads(res.data)
+
+        self.assertEqual(res.status_code, 400)
+        self.assertEqual(data['success'], False)
+        self.assertEqual(data['message'], 'Bad request')
+
         # delete questions
 
     def test_delete_questions(self):
@@ -114,6 +264,111 @@ class TriviaTestCase(unittest.TestCase):
         self.assertTrue(data['created'])
         self.assertTrue(len(data['questions']))
 
+    def test_create_question_minimal_return(self):
+        res = self.client().post('/questions?return=minimal',
+                                 json=self.new_question)
+        data = json.loads(res.data)
+
+        self.assertEqual(res.status_code, 200)
+        self.assertTrue(data['created'])
+        self.assertTrue(data['totalQuestions'])
+        self.assertNotIn('questions', data)
+
+    def test_create_question_updates_category_count(self):
+        before = json.loads(self.client().get('/categories/5/questions').data)
+        self.client().post('/questions', json=self.new_question)
+        after = json.loads(self.client().get('/categories/5/questions').data)
+
+        self.assertEqual(after['totalQuestions'], before['totalQuestions'] + 1)
+
+    def test_create_question_updates_total_after_bulk_update(self):
+        first = json.loads(self.client().post(
+            '/questions?return=minimal', json=self.new_question).data)
+        self.client().patch('/questions', json={
+            'ids': [first['created']], 'set': {'difficulty': 2}})
+        second = json.loads(self.client().post(
+            '/questions?return=minimal', json=self.new_question).data)
+
+        self.assertEqual(second['totalQuestions'], first['totalQuestions'] + 1)
+
+    def test_bulk_create_questions(self):
+        rows = [self.new_question, self.new_question,
+                dict(self.new_question, category=5600)]
+        res = self.client().post('/questions/bulk', json=rows)
+        data = json.loads(res.data)
+
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(data['inserted'], 2)
+        self.assertEqual(data['rejected'], 1)
+        self.assertEqual(data['errors'][0]['row'], 2)
+
+    def test_bulk_create_questions_rejects_non_integers(self):
+        rows = [dict(self.new_question, category='5'),
+                dict(self.new_question, difficulty=1.9),
+                dict(self.new_question, category=True)]
+        res = self.client().post('/questions/bulk', json=rows)
+        data = json.loads(res.data)
+
+        self.assertEqual(data['inserted'], 1)
+        self.assertEqual([error['row'] for error in data['errors']], [1, 2])
+
+    def test_bulk_create_questions_from_ndjson(self):
+        body = '\n'.join(json.dumps(self.new_question) for _ in range(3))
+        res = self.client().post('/questions/bulk', data=body,
+                                 content_type='application/x-ndjson')
+        data = json.loads(res.data)
+
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(data['inserted'], 3)
+        self.assertEqual(data['rejected'], 0)
+
+    def test_bulk_delete_questions(self):
+        created = [json.loads(self.client().post(
+            '/questions', json=self.new_question).data)['created']
+            for _ in range(2)]
+        res = self.client().post('/questions/bulk-delete',
+                                 json={'ids': created})
+        data = json.loads(res.data)
+
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(data['deleted'], 2)
+
+    def test_bulk_update_questions(self):
+        created = json.loads(self.client().post(
+            '/questions', json=self.new_question).data)['created']
+        res = self.client().patch('/questions', json={
+            'ids': [created], 'set': {'category': 3, 'difficulty': 2}})
+        data = json.loads(res.data)
+
+        with self.app.app_context():
+            question = Question.query.get(created)
+
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(data['updated'], 1)
+        self.assertEqual(int(question.category), 3)
+        self.assertEqual(question.difficulty, 2)
+
+    def test_422_bulk_delete_without_selection(self):
+        res = self.client().post('/questions/bulk-delete', json={})
+
+        self.assertEqual(res.status_code, 422)
+
+    def test_export_questions_as_ndjson(self):
+        res = self.client().get('/questions/export?format=ndjson')
+        rows = [json.loads(line) for line in res.data.splitlines()]
+
+        with self.app.app_context():
+            total = Question.query.count()
+
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(len(rows), total)
+        self.assertTrue(rows[0]['question'])
+
+    def test_400_export_questions_unknown_format(self):
+        res = self.client().get('/questions/export?format=xml')
+
+        self.assertEqual(res.status_code, 400)
+
     def test_405_if_question_not_allowed(self):
         res = self.client().post('/questions/10000', json=self.new_question)
         data = json.loads(res.data)
@@ -123,6 +378,148 @@ class TriviaTestCase(unittest.TestCase):
         self.assertEqual(data['message'], "Method not allowed")
 
     # search
+    def test_search_questions(self):
+        res = self.client().post('/questions', json={'searchTerm': 'title'})
+        data = json.loads(res.data)
+
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(data['success'], True)
+        self.assertTrue(len(data['questions']))
+        self.assertTrue(len(data['questions']) <= QUESTIONS_PER_PAGE)
+        self.assertTrue(data['total_questions'] >= len(data['questions']))
+
+    def test_search_questions_in_memory_index(self):
+        self.app.config['SEARCH_BACKEND'] = 'memory'
+        res = self.client().post('/questions', json={'searchTerm': 'Title'})
+        data = json.loads(res.data)
+
+        self.assertEqual(res.status_code, 200)
+        self.assertTrue(len(data['questions']))
+        for question in data['questions']:
+            self.assertIn('title', question['question'].lower())
+
+    def test_question_counts_drop_load_raced_by_a_write(self):
+        counts = QuestionCounts()
+        loads = [{1: 5}, {1: 6}]
+
+        def load():
+            loaded = loads.pop(0)
+            if loads:
+                # an insert commits after the GROUP BY read the table
+                counts.on_change('insert', Question('q', 'a', 1, 1))
+            return loaded
+        counts.load = load
+
+        self.assertEqual(counts.for_category(1), 5)
+        self.assertEqual(counts.for_category(1), 6)
+
+    def test_question_pools_drop_load_raced_by_a_write(self):
+        pools = QuestionPools()
+        loads = [array('I', [1, 2]), array('I', [1, 2, 3])]
+
+        def load(category):
+            loaded = loads.pop(0)
+            if loads:
+                question = Question('q', 'a', 1, 1)
+                question.id = 3
+                pools.on_change('insert', question)
+            return loaded
+        pools.load = load
+
+        self.assertEqual(list(pools.ids(1)), [1, 2])
+        self.assertEqual(list(pools.ids(1)), [1, 2, 3])
+
+    def test_search_index_narrows_by_category_and_difficulty(self):
+        index = InvertedIndex()
+        with self.app.app_context():
+            index.search(['zebra'])
+            questions = [Question('Zebra crossing', 'yes', 2, 4),
+                         Question('Zebra stripes', 'yes', 3, 4),
+                         Question('Zebra legs', 'four', 2, 1)]
+            for question in questions:
+                question.insert()
+                index.on_change('insert', question)
+
+            self.assertEqual(index.search(['zebra'], category=2),
+                             [questions[0].id, questions[2].id])
+            self.assertEqual(index.search(['zebra'], difficulty=4),
+                             [questions[0].id, questions[1].id])
+            self.assertEqual(index.search(['zebra'], 3, 1), [])
+
+    def test_search_index_survives_bulk_write_during_build(self):
+        index = InvertedIndex()
+        load = index.load
+
+        def load_then_drop():
+            loaded = load()
+            if not dropped:
+                dropped.append(True)
+                index.on_change('bulk', None)
+            return loaded
+        dropped = []
+        index.load = load_then_drop
+
+        with self.app.app_context():
+            self.assertTrue(index.search(['title']))
+        self.assertTrue(dropped)
+
+    def test_search_index_picks_up_other_workers_writes(self):
+        index = InvertedIndex(catch_up_ttl=0)
+        loads = []
+        load = index.load
+        index.load = lambda: loads.append(True) or load()
+
+        def settle():
+            while index.refreshing:
+                time.sleep(0.01)
+
+        with self.app.app_context():
+            index.search(['zanzibar'])
+            settle()
+            # not through the listeners of this index, as in another worker
+            question = Question('Where is Zanzibar', 'Tanzania', 3, 1)
+            question.insert()
+            index.search(['zanzibar'])
+            settle()
+            self.assertTrue(index.search(['zanzibar']))
+
+            question.delete()
+            index.search(['zanzibar'])
+            settle()
+            self.assertEqual(index.search(['zanzibar']), [])
+        # caught up without reloading the whole table
+        self.assertEqual(len(loads), 1)
+
+    def test_get_search_questions_in_category(self):
+        res = self.client().get(
+            '/questions/search?searchTerm=title&category=4')
+        data = json.loads(res.data)
+
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(data['success'], True)
+        self.assertEqual(data['current_category'], 4)
+        self.assertIn('max-age', res.headers['Cache-Control'])
+        for question in data['questions']:
+            self.assertEqual(int(question['category']), 4)
+
+    def test_suggest_words(self):
+        res = self.client().get('/questions/suggest?prefix=tit')
+        data = json.loads(res.data)
+
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(data['success'], True)
+        self.assertTrue(len(data['suggestions']))
+        for suggestion in data['suggestions']:
+            self.assertTrue(suggestion['word'].startswith('tit'))
+            self.assertTrue(suggestion['count'])
+
+    def test_400_suggest_without_prefix(self):
+        res = self.client().get('/questions/suggest')
+        data = json.loads(res.data)
+
+        self.assertEqual(res.status_code, 400)
+        self.assertEqual(data['success'], False)
+
     def test_searchTerm_not_found(self):
         search = 'Who'
         res = self.client().post('/questions/search',
@@ -168,6 +565,88 @@ class TriviaTestCase(unittest.TestCase):
         self.assertEqual(data['success'], True)
         self.assertTrue(data['question'])
 
+    def test_play_quiz_in_category(self):
+        quiz = {'previous_questions': [],
+                'quiz_category': {'type': 'Entertainment', 'id': 5}}
+        res = self.client().post('/quizzes', json=quiz)
+        data = json.loads(res.data)
+
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(data['success'], True)
+        self.assertEqual(int(data['question']['category']), 5)
+
+    def test_play_quiz_skips_previous_questions(self):
+        with self.app.app_context():
+            ids = [question.id for question in Question.query.filter(
+                Question.category == 5).all()]
+        quiz = {'previous_questions': ids[1:],
+                'quiz_category': {'type': 'Entertainment', 'id': 5}}
+        res = self.client().post('/quizzes', json=quiz)
+        data = json.loads(res.data)
+
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(data['question']['id'], ids[0])
+
+    def test_play_quiz_ends_when_questions_run_out(self):
+        with self.app.app_context():
+            ids = [question.id for question in Question.query.filter(
+                Question.category == 5).all()]
+        quiz = {'previous_questions': ids,
+                'quiz_category': {'type': 'Entertainment', 'id': 5}}
+        res = self.client().post('/quizzes', json=quiz)
+        data = json.loads(res.data)
+
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(data['success'], True)
+        self.assertEqual(data['question'], None)
+
+    def test_play_quiz_batch(self):
+        quiz = {'previous_questions': [],
+                'quiz_category': {'type': 'click', 'id': 0},
+                'count': 3}
+        res = self.client().post('/quizzes', json=quiz)
+        data = json.loads(res.data)
+        ids = [question['id'] for question in data['questions']]
+
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(len(ids), 3)
+        self.assertEqual(len(set(ids)), 3)
+
+    def test_422_play_quiz_batch_too_large(self):
+        quiz = {'previous_questions': [],
+                'quiz_category': {'type': 'click', 'id': 0},
+                'count': 1000}
+        res = self.client().post('/quizzes', json=quiz)
+        data = json.loads(res.data)
+
+        self.assertEqual(res.status_code, 422)
+        self.assertEqual(data['success'], False)
+
+    def test_quiz_session_deals_each_question_once(self):
+        quiz = {'quiz_category': {'type': 'Entertainment', 'id': 5}}
+        res = self.client().post('/quizzes/sessions', json=quiz)
+        session = json.loads(res.data)
+        self.assertEqual(res.status_code, 201)
+
+        seen = []
+        for _ in range(session['total_questions']):
+            data = json.loads(self.client().get(
+                '/quizzes/sessions/{}/next'.format(
+                    session['session_id'])).data)
+            seen.append(data['question']['id'])
+        data = json.loads(self.client().get(
+            '/quizzes/sessions/{}/next'.format(session['session_id'])).data)
+
+        self.assertEqual(len(seen), len(set(seen)))
+        self.assertEqual(data['question'], None)
+
+    def test_404_quiz_session_doesnt_exist(self):
+        res = self.client().get('/quizzes/sessions/unknown/next')
+        data = json.loads(res.data)
+
+        self.assertEqual(res.status_code, 404)
+        self.assertEqual(data['success'], False)
+
     def test_422_fetch_quiz(self):
         res = self.client().post('/quizzes', json={'previous_questions': []})
         data = json.loads(res.data)
@@ -176,6 +655,409 @@ class TriviaTestCase(unittest.TestCase):
         self.assertEqual(data['success'], False)
         self.assertEqual(data['message'], "Can't be processed")
 
-        # Make the tests conveniently executable
+
+class FakeRedisClient:
+    """Answers the Redis commands RedisBackend sends, from a dict"""
+
+    def __init__(self):
+        self.data = {}
+
+    def execute(self, command, *args):
+        if command == 'GET':
+            return self.data.get(args[0])
+        if command == 'SET':
+            self.data[args[0]] = args[1]
+            return b'OK'
+        if command == 'DEL':
+            return int(self.data.pop(args[0], None) is not None)
+        if command == 'INCRBY':
+            self.data[args[0]] = str(int(self.data.get(args[0], 0)) + args[1])
+            return int(self.data[args[0]])
+        if command == 'PEXPIRE':
+            return int(args[0] in self.data)
+        if command == 'DBSIZE':
+            return len(self.data)
+
+
+class FakeRedisServer(socketserver.ThreadingTCPServer):
+    """Speaks the Redis protocol on a local port, answering each database
+    from a FakeRedisClient"""
+
+    daemon_threads = True
+
+    def __init__(self):
+        super().__init__(('127.0.0.1', 0), FakeRedisHandler)
+        self.databases = defaultdict(FakeRedisClient)
+
+
+class FakeRedisHandler(socketserver.StreamRequestHandler):
+
+    def handle(self):
+        database = 0
+        while True:
+            line = self.rfile.readline()
+            if not line:
+                return
+            args = []
+            for _ in range(int(line[1:])):
+                length = int(self.rfile.readline()[1:])
+                args.append(self.rfile.read(length + 2)[:-2])
+            command = args[0].decode().upper()
+            if command == 'SELECT':
+                database = int(args[1])
+                self.wfile.write(b'+OK\r\n')
+                continue
+            params = [arg.decode() for arg in args[1:2]] + args[2:]
+            if command == 'SET':
+                # expiry isn't simulated
+                params = params[:2]
+            if command == 'INCRBY':
+                params[1] = int(params[1])
+            reply = self.server.databases[database].execute(command, *params)
+            self.wfile.write(resp_reply(reply))
+
+
+def resp_reply(value):
+    if value is None:
+        return b'$-1\r\n'
+    if isinstance(value, int):
+        return b':%d\r\n' % value
+    if isinstance(value, str):
+        value = value.encode()
+    return b'$%d\r\n%s\r\n' % (len(value), value)
+
+
+class CacheBackendTestCase(unittest.TestCase):
+    """This class represents the cache backend test case"""
+
+    def backends(self):
+        directory = tempfile.mkdtemp()
+        return [MemoryBackend(),
+                SQLiteBackend(os.path.join(directory, 'cache.db')),
+                RedisBackend(FakeRedisClient())]
+
+    def test_namespaced_cache_round_trip(self):
+        for backend in self.backends():
+            cache = NamespacedCache(backend, 'test')
+            cache.set('questions', 'page=1', {'questions': [1, 2]}, 30)
+
+            self.assertEqual(cache.get('questions', 'page=1'),
+                             {'questions': [1, 2]})
+            self.assertEqual(cache.get('questions', 'page=2'), None)
+
+    def test_namespaced_cache_invalidation(self):
+        for backend in self.backends():
+            cache = NamespacedCache(backend, 'test')
+            cache.set('questions', 'page=1', b'first', 30)
+            cache.set('category:5', 'page=1', b'second', 30)
+            cache.invalidate('questions')
+
+            self.assertEqual(cache.get('questions', 'page=1'), None)
+            self.assertEqual(cache.get('category:5', 'page=1'), b'second')
+
+            cache.invalidate()
+            self.assertEqual(cache.get('category:5', 'page=1'), None)
+
+    def test_backend_session_store_deals_each_question_once(self):
+        for backend in self.backends():
+            # two workers sharing the backend
+            first = BackendSessionStore(backend)
+            second = BackendSessionStore(backend)
+            first.set('quiz', QuizSession(array('I', [4, 8, 15, 16])))
+
+            dealt = [first.get('quiz').deal(), second.get('quiz').deal()]
+            dealt += second.get('quiz').deal_many(3)
+
+            self.assertEqual(sorted(dealt), [4, 8, 15, 16])
+            self.assertEqual(first.get('quiz').remaining(), 0)
+            self.assertEqual(first.get('unknown'), None)
+
+    def test_memory_session_store_is_bounded_by_bytes(self):
+        store = MemorySessionStore(max_bytes=1000)
+        store.set('first', QuizSession(array('I', range(200))))
+        store.set('second', QuizSession(array('I', range(200))))
+
+        self.assertEqual(store.get('first'), None)
+        self.assertEqual(store.get('second').remaining(), 200)
+        self.assertEqual(store.size, 800)
+
+    def test_quiz_session_deals_concurrently_once(self):
+        session = QuizSession(array('I', range(1000)))
+        dealt = []
+
+        def deal():
+            while True:
+                question_id = session.deal()
+                if question_id is None:
+                    return
+                dealt.append(question_id)
+
+        threads = [threading.Thread(target=deal) for _ in range(4)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        self.assertEqual(sorted(dealt), list(range(1000)))
+
+    def test_table_versions_are_shared_between_workers(self):
+        for backend in self.backends()[1:]:
+            first = TableVersions(backend, shared=True)
+            second = TableVersions(backend, shared=True)
+            token = second.token(['questions', 'categories'])
+            first.bump('questions')
+
+            self.assertNotEqual(second.token(['questions', 'categories']),
+                                token)
+            self.assertEqual(first.token(['questions']),
+                             second.token(['questions']))
+
+    def test_response_built_during_a_write_is_not_cached(self):
+        app = Flask(__name__)
+        app.extensions['response_cache'] = ResponseCache()
+        bodies = ['old', 'new']
+
+        @app.route('/probe')
+        @cached('questions')
+        def probe():
+            body = bodies.pop(0)
+            if body == 'old':
+                # a write commits while the view reads the old rows
+                app.extensions['response_cache'].invalidate('questions')
+            return body
+
+        client = app.test_client()
+        self.assertEqual(client.get('/probe').data, b'old')
+        self.assertEqual(client.get('/probe').data, b'new')
+        self.assertEqual(client.get('/probe').data, b'new')
+
+    def test_memory_cache_urls_are_not_shared(self):
+        for url in ('memory://', 'memory:', 'memory:///'):
+            app = create_app({'CACHE_URL': url})
+
+            self.assertFalse(app.extensions['table_versions'].shared)
+            self.assertIsInstance(app.config['QUIZ_SESSION_STORE'],
+                                  MemorySessionStore)
+
+    def test_redis_backend_over_a_socket(self):
+        server = FakeRedisServer()
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        try:
+            backend = RedisBackend(
+                RespClient(*server.server_address, db=2, timeout=5))
+            value = bytes(range(256)) + b'\r\n'
+            backend.set('binary', value, 30)
+
+            self.assertEqual(backend.get('binary'), value)
+            self.assertEqual(backend.get('missing'), None)
+            self.assertEqual(backend.incr('counter', 5, 30), 5)
+            self.assertEqual(backend.incr('counter'), 6)
+            self.assertEqual(backend.stats(), {'entries': 2})
+            self.assertEqual(server.databases[0].data, {})
+        finally:
+            server.shutdown()
+            server.server_close()
+
+    def test_memory_backend_evicts_least_recently_used(self):
+        backend = MemoryBackend(max_bytes=100)
+        backend.set('a', b'x' * 40)
+        backend.set('b', b'x' * 40)
+        backend.get('a')
+        backend.set('c', b'x' * 40)
+
+        self.assertEqual(backend.get('b'), None)
+        self.assertEqual(backend.get('a'), b'x' * 40)
+        self.assertEqual(backend.stats()['evictions'], 1)
+
+    def test_single_flight_shares_one_call(self):
+        flight = SingleFlight()
+        calls = []
+        results = []
+
+        def load():
+            calls.append(1)
+            time.sleep(0.2)
+            return b'page'
+
+        threads = [threading.Thread(
+            target=lambda: results.append(flight.do('page=1', load)))
+            for _ in range(5)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        self.assertEqual(len(calls), 1)
+        self.assertEqual(results, [b'page'] * 5)
+
+
+class MigrationsTestCase(unittest.TestCase):
+    """This class represents the schema migrations test case"""
+
+    def setUp(self):
+        directory = tempfile.mkdtemp()
+        self.engine = create_engine(
+            'sqlite:///' + os.path.join(directory, 'trivia.db'))
+
+    def test_upgrade_applies_pending_migrations_once(self):
+        with self.engine.connect() as connection:
+            self.assertEqual(
+                migrations.pending(connection),
+                [m.revision for m in migrations.load_migrations()])
+
+        applied = migrations.upgrade(self.engine)
+
+        with self.engine.connect() as connection:
+            self.assertEqual(migrations.current_revision(connection),
+                             migrations.head())
+            self.assertEqual(migrations.pending(connection), [])
+        self.assertTrue(applied)
+        self.assertEqual(migrations.upgrade(self.engine), [])
+
+    def test_upgrade_indexes_question_category(self):
+        migrations.upgrade(self.engine)
+        indexes = {index['name']: index['column_names']
+                   for index in inspect(self.engine).get_indexes('questions')}
+
+        self.assertEqual(indexes['ix_questions_category_id'],
+                         ['category', 'id'])
+        self.assertEqual(indexes['ix_questions_category_difficulty'],
+                         ['category', 'difficulty'])
+
+    def test_upgrade_keeps_existing_tables(self):
+        self.engine.execute(
+            'CREATE TABLE categories (id INTEGER PRIMARY KEY, type VARCHAR)')
+        self.engine.execute(
+            'CREATE TABLE questions (id INTEGER PRIMARY KEY, '
+            'question VARCHAR, answer VARCHAR, difficulty INTEGER, '
+            'category INTEGER)')
+        self.engine.execute("INSERT INTO categories VALUES (1, 'Science')")
+        self.engine.execute(
+            "INSERT INTO questions VALUES (1, 'Why?', 'Because', 1, 1)")
+
+        migrations.upgrade(self.engine)
+
+        self.assertEqual(self.engine.execute(
+            'SELECT COUNT(*) FROM questions').scalar(), 1)
+
+    def test_downgrade_reverts_latest_migration(self):
+        migrations.upgrade(self.engine)
+        reverted = migrations.downgrade(self.engine)
+
+        with self.engine.connect() as connection:
+            self.assertEqual(migrations.pending(connection), reverted)
+
+    def test_downgrade_keeps_the_initial_tables(self):
+        migrations.upgrade(self.engine, '0001')
+
+        with self.assertRaises(migrations.MigrationError):
+            migrations.downgrade(self.engine)
+        with self.engine.connect() as connection:
+            self.assertEqual(migrations.current_revision(connection), '0001')
+        self.assertIn('questions', inspect(self.engine).get_table_names())
+
+
+class ReplicaRoutingTestCase(unittest.TestCase):
+    """This class represents the read replica routing test case"""
+
+    def setUp(self):
+        directory = tempfile.mkdtemp()
+        self.primary = 'sqlite:///' + os.path.join(directory, 'primary.db')
+        self.replica = 'sqlite:///' + os.path.join(directory, 'replica.db')
+        for path, name in ((self.primary, 'primary'),
+                           (self.replica, 'replica')):
+            engine = create_engine(path)
+            migrations.upgrade(engine)
+            engine.execute("INSERT INTO categories (type) VALUES ('Science')")
+            engine.execute(
+                "INSERT INTO questions (question, answer, category, "
+                "difficulty) VALUES ('on the {}', 'yes', 1, 1)".format(name))
+
+        self.app = create_app({
+            'DATABASE_URL': self.primary,
+            'DATABASE_REPLICA_URLS': [self.replica]
+        })
+        self.client = self.app.test_client()
+
+    def questions(self, client=None):
+        res = (client or self.client).get('/categories/1/questions')
+        return [question['question']
+                for question in json.loads(res.data)['questions']]
+
+    def test_reads_go_to_replica(self):
+        self.assertEqual(self.questions(), ['on the replica'])
+
+    def test_reads_after_a_write_go_to_primary(self):
+        self.client.post('/questions', json={
+            'question': 'new', 'answer': 'yes', 'category': 1,
+            'difficulty': 1})
+
+        self.assertEqual(self.questions(), ['on the primary', 'new'])
+
+    def test_unreachable_replica_falls_back_to_primary(self):
+        app = create_app({
+            'DATABASE_URL': self.primary,
+            'DATABASE_REPLICA_URLS': ['sqlite:////nonexistent/replica.db']
+        })
+        res = app.test_client().get('/categories/1/questions')
+        data = json.loads(res.data)
+
+        self.assertEqual(data['questions'][0]['question'], 'on the primary')
+
+    def test_reads_right_after_any_write_go_to_primary(self):
+        self.client.post('/questions', json={
+            'question': 'new', 'answer': 'yes', 'category': 1,
+            'difficulty': 1})
+
+        other = self.app.test_client()
+        self.assertEqual(self.questions(other), ['on the primary', 'new'])
+
+    def test_search_is_not_a_write(self):
+        res = self.client.post('/questions', json={'searchTerm': 'on'})
+
+        self.assertEqual(res.status_code, 200)
+        self.assertNotIn('Set-Cookie', res.headers)
+        self.assertEqual(self.questions(), ['on the replica'])
+
+    def test_reads_after_a_write_skip_cached_replica_reads(self):
+        # another worker that already cached the category from the replica
+        worker = create_app({
+            'DATABASE_URL': self.primary,
+            'DATABASE_REPLICA_URLS': [self.replica]
+        }).test_client()
+        self.assertEqual(self.questions(worker), ['on the replica'])
+
+        res = self.client.post('/questions', json={
+            'question': 'new', 'answer': 'yes', 'category': 1,
+            'difficulty': 1})
+        cookie = res.headers['Set-Cookie'].split(';')[0].split('=', 1)
+        worker.set_cookie('localhost', *cookie)
+
+        self.assertEqual(self.questions(worker), ['on the primary', 'new'])
+        res = worker.get('/questions/search?searchTerm=new')
+        self.assertEqual(json.loads(res.data)['total_questions'], 1)
+
+    def test_replica_is_probed_only_until_verified(self):
+        router = ReplicaRouter([create_engine(self.replica)])
+        connects = []
+        event.listen(router.replicas[0].engine, 'connect',
+                     lambda connection, record: connects.append(1))
+
+        for _ in range(3):
+            self.assertIsNotNone(router.choose())
+        self.assertEqual(len(connects), 1)
+
+    def test_failed_replica_connection_marks_it_down(self):
+        router = ReplicaRouter(
+            [create_engine('sqlite:////nonexistent/replica.db')])
+        router.replicas[0].verified = True
+
+        with self.assertRaises(OperationalError):
+            router.choose().connect()
+        self.assertEqual(router.choose(), None)
+        self.assertFalse(router.replicas[0].available())
+
+
+# Make the tests conveniently executable
 if __name__ == "__main__":
     unittest.main()